@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+"""Benchmarks for the sequencing hot path, run in virtual time against a recording MIDI backend
+
+    python3 benchmarks/bench.py                  # everything
+    python3 benchmarks/bench.py driver patterns  # just some
+
+"""
+
+import sys, os, io, time, contextlib
+names = sys.argv[1:]
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from braid import *
+from braid import midi
+from braid.tween import ScalarTween
+
+
+recorder = midi.RecordingMidi()
+midi_out.midi = recorder
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return [samples[min(int(len(samples) * p), len(samples) - 1)] * 1e6 for p in (0.5, 0.9, 0.99, 1.0)]
+
+
+def report(name, samples, count=None, elapsed=None, unit="events"):
+    p50, p90, p99, top = percentiles(samples)
+    line = "%-64s p50 %8.1fus  p90 %8.1fus  p99 %8.1fus  max %8.1fus" % (name, p50, p90, p99, top)
+    if count is not None:
+        line += "  %10.0f %s/s" % (count / elapsed, unit)
+    print(line)
+
+
+def timed(f, n):
+    samples = []
+    for i in range(n):
+        c = time.perf_counter()
+        f()
+        samples.append(time.perf_counter() - c)
+    return samples
+
+
+def quiet():
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+"""Signals"""
+
+def bench_signals():
+    signals = {
+        'linear': linear(),
+        'sine': sine(),
+        'triangle': triangle(),
+        'pulse': pulse(),
+        'ease_in_out': ease_in_out(),
+        'noise': noise(),
+        'composed sine': sine(a=sine(p=triangle(s=pulse(r=4), r=2))),
+        'breakpoints(7)': breakpoints([0, 0], [2, 1, linear()], [6, 2, ease_out()], [7, 0], [12, 3, ease_in()], [14, 2, ease_out()], [15, 0, ease_in_out()]),
+        'cross(64)': cross(64, 3),
+        'breakpoints(500)': breakpoints(*[[i, random(), linear()] for i in range(500)]),
+        'breakpoints(500) cursor': breakpoints(*[[i, random(), linear()] for i in range(500)], cursor=True),
+        'wavetable(composed sine)': wavetable(sine(a=sine(p=triangle(s=pulse(r=4), r=2)))),
+    }
+    positions = [i / 10000 for i in range(10000)]
+    for name, f in signals.items():
+        def run():
+            for pos in positions:
+                f(pos)
+        samples = [s / len(positions) for s in timed(run, 5)]
+        report("signal %s" % name, samples, len(positions) * 5, sum(samples) * len(positions), "calls")
+    for name in ('composed sine', 'wavetable(composed sine)'):
+        samples = [s / len(positions) for s in timed(lambda: evaluate(signals[name], positions), 5)]
+        report("evaluate %s" % name, samples, len(positions) * 5, sum(samples) * len(positions), "values")
+
+
+"""Tweens"""
+
+class Clock(object):
+    _cycles = 0.0
+
+
+def bench_tweens(n=1000, reads=50):
+    clock = Clock()
+    tweens = []
+    for i in range(n):
+        t = ScalarTween(127, 1 + (i % 8), [linear(), sine(), ease_in_out()][i % 3], osc=bool(i % 2))
+        t.start(clock, 0)
+        tweens.append(t)
+    samples = []
+    with quiet():
+        for r in range(reads):
+            clock._cycles += 0.01
+            c = time.perf_counter()
+            for t in tweens:
+                t.value
+            samples.append(time.perf_counter() - c)
+        cached = timed(lambda: [t.value for t in tweens], reads)
+    report("tween.value x%d per tick" % n, samples, n * reads, sum(samples), "reads")
+    report("tween.value x%d re-read in the same tick" % n, cached, n * reads, sum(cached), "reads")
+    del driver.tweens[:]
+
+
+"""Patterns"""
+
+def bench_patterns():
+    patterns = {
+        'flat 16': [1, 0, 2, 0] * 4,
+        'nested': [1, [2, 3], [4, [5, 6, 7]], 0],
+        'polyrhythm 7:11:13': [[1] * 7, [1] * 11, [1] * 13],
+        'deep polyrhythm': [[1, [2, 3, 4], 0] * 3, [[1] * 5, [1] * 7], [1] * 11],
+        'polyrhythm 17:19:23:29 (lcm 215441)': [[1] * 17, [1] * 19, [1] * 23, [1] * 29],
+        'stochastic': [(1, 2), Q([3, 4, 5]), [1, (2, 0)], (1, Z)] * 4,
+        'stochastic sublists': [([1, 2], [1, 2, 3]), 0, 1, 0],
+    }
+    for name, p in patterns.items():
+        p = Pattern(p)
+        samples = timed(p.resolve, 500)
+        report("resolve %s" % name, samples, 500, sum(samples), "resolves")
+
+
+"""Driver"""
+
+Synth = make({'cutoff': 20, 'resonance': 21}, {'cutoff': 64})
+
+
+def make_threads(n, controls=0):
+    """A mix of typical threads; every controls-th one has a tweened CC"""
+    patterns = [
+        [1, 0, 1, 0] * 4,
+        euc(16, 5),
+        [[1, 2, 3], [4, 0, 5, 0]],
+        [1, [2, 2], 0, (3, 4)],
+        [[1] * 7, [1] * 11],
+        [1, Z, 0, 1],
+    ]
+    threads = []
+    with quiet():
+        for i in range(n):
+            t = Synth((i % 16) + 1) if controls and not i % controls else Thread((i % 16) + 1)
+            t.pattern = patterns[i % len(patterns)]
+            t.rate = [1, 0.5, 0.25, 2, 1 / 3][i % 5]
+            if i % 3 == 0:
+                t.chord = C, [MAJ, DOR, PEN][i % 3]
+            if controls and not i % controls:
+                t.cutoff = osc(0, 127, 4)
+            t.start()
+            threads.append(t)
+    return threads
+
+
+def run_driver(name, seconds, scheduled, compact=False):
+    driver.scheduled = scheduled
+    driver.compact = compact
+    driver._edges = []
+    driver._table = None
+    midi_out.flush()
+    del recorder.messages[:]
+    samples = []
+    end_t = driver.t + seconds
+    start = time.perf_counter()
+    with quiet():
+        while driver.t < end_t:
+            t = driver.next_edge() if scheduled else driver.t + driver.grain
+            delta_t, driver.t = t - driver.t, t
+            c = time.perf_counter()
+            driver.update(delta_t)
+            samples.append(time.perf_counter() - c)
+    elapsed = time.perf_counter() - start
+    midi_out.flush()
+    events = len(recorder.messages)
+    report("%s (%d ticks, x%.0f realtime)" % (name, len(samples), seconds / elapsed), samples, events, elapsed)
+
+
+def bench_driver():
+    tempo(120)
+    for n, controls in ((16, 0), (64, 4), (256, 0), (512, 8)):
+        del driver.threads[:]
+        make_threads(n, controls)
+        label = "%d threads%s" % (n, ", tweened CCs" if controls else "")
+        run_driver("driver polled, %s" % label, 8, False)
+        run_driver("driver scheduled, %s" % label, 8, True)
+        run_driver("driver compact, %s" % label, 8, False, True)
+    driver.compact = False
+    del driver.threads[:]
+
+
+def bench_thread():
+    tempo(120)
+    del driver.threads[:]
+    threads = make_threads(256, 8)
+    samples = []
+    with quiet():
+        for tick in range(400):
+            driver.t += driver.grain
+            driver._cycles += driver.grain * driver.rate
+            for t in threads:
+                c = time.perf_counter()
+                t.update(driver.t - t._t)
+                t._t = driver.t
+                samples.append(time.perf_counter() - c)
+    report("thread.update (256 threads)", samples, len(samples), sum(samples), "updates")
+    del driver.threads[:]
+
+
+def bench_triggers(n=5000):
+    tempo(120)
+    del driver.threads[:]
+    with quiet():
+        t = Thread(1)
+        t.pattern = [1, 0, 1, 0]
+        t.start()
+        for i in range(n):
+            t.trigger(lambda: None, 4 + i)
+            trigger(lambda: None, 4 + i)
+    run_driver("driver scheduled, 1 thread, %d pending thread and universal triggers" % n, 8, True)
+    t.trigger(False)
+    trigger(False)
+    del driver.threads[:]
+
+
+benchmarks = {
+    'signals': bench_signals,
+    'tweens': bench_tweens,
+    'patterns': bench_patterns,
+    'thread': bench_thread,
+    'driver': bench_driver,
+    'triggers': bench_triggers,
+}
+
+for name, f in benchmarks.items():
+    if not names or name in names:
+        f()
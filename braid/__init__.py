@@ -1,18 +1,37 @@
-import inspect
+import inspect, weakref
+
+_arities = weakref.WeakKeyDictionary()  # function -> positional argument count, forgotten when the function is garbage-collected
 
 def num_args(f):
-    """Returns the number of arguments received by the given function"""
-    return len(inspect.getargspec(f).args)
+    """Returns the number of arguments received by the given function (not counting the self of bound methods)"""
+    key, bound = (f.__func__, 1) if inspect.ismethod(f) else (f, 0)   # bound methods are made anew on every access
+    try:
+        return _arities[key] - bound
+    except KeyError:
+        pass
+    except TypeError:   # can't be weakly referenced or hashed, so don't cache
+        return count_args(f)
+    _arities[key] = count_args(key)
+    return _arities[key] - bound
+
+def count_args(f):
+    try:
+        parameters = inspect.signature(f).parameters.values()
+    except (TypeError, ValueError):     # eg, builtins without a signature
+        return 0
+    return len([p for p in parameters if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)])
 
 from .midi import midi_out
 
 from .thread import *
 from .signal import *
 from .core import *
-from . import custom
 
 def log_midi(value):
     midi.log_midi = True if value else False
 
-if LIVECODING:
-    play()
+def __getattr__(name):
+    """Synth Threads are only made when first used; `from braid import *` asks for them all by name"""
+    if name == '__all__':
+        return [name for name in globals() if not name.startswith('_')] + list(thread.load_synths())
+    return getattr(thread, name)
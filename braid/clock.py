@@ -0,0 +1,237 @@
+import time, math, threading
+from .midi import TIMING_CLOCK, START, CONTINUE, STOP
+
+
+class Clock(object):
+    """A source of time, in seconds, for the Driver"""
+
+    def reset(self, t=0.0):
+        """Start counting from t"""
+        raise NotImplementedError
+
+    def now(self):
+        raise NotImplementedError
+
+    def sleep_until(self, t, wake):
+        """Block until time t, returning early if the wake event is set"""
+        remaining = t - self.now()
+        if remaining > 0 and wake.wait(remaining):
+            wake.clear()
+
+
+class RealtimeClock(Clock):
+    """Monotonic, high-resolution wall time"""
+
+    def __init__(self, t=0.0):
+        self.reset(t)
+
+    def reset(self, t=0.0):
+        self.start_t = time.perf_counter_ns() - int(t * 1e9)
+
+    def now(self):
+        return (time.perf_counter_ns() - self.start_t) / 1e9
+
+
+class VirtualClock(Clock):
+    """Time that only moves when told to
+       Sleeping jumps straight to the deadline, so everything runs as fast as possible
+       Set manual=True to instead block sleeps until advance() or set() moves time past them (eg, for tests)
+    """
+
+    def __init__(self, t=0.0, manual=False):
+        self.manual = manual
+        self._condition = threading.Condition()
+        self.reset(t)
+
+    def reset(self, t=0.0):
+        self.set(t)
+
+    def now(self):
+        return self.t
+
+    def set(self, t):
+        with self._condition:
+            self.t = t
+            self._condition.notify_all()
+
+    def advance(self, seconds):
+        self.set(self.t + seconds)
+
+    def sleep_until(self, t, wake):
+        if not self.manual:
+            if wake.is_set():
+                wake.clear()
+            elif t > self.t:
+                self.t = t
+            return
+        with self._condition:
+            while self.t < t and not wake.is_set():
+                self._condition.wait(0.01)
+        wake.clear()
+
+
+class MidiClock(Clock):
+    """Time slaved to incoming 24ppqn MIDI clock, following start, stop and continue
+       A phase-locked loop smooths pulse arrival times into a tempo, which drives driver.rate,
+       and a phase, which sets time so that the driver advances exactly 1/96 of a cycle per pulse
+       Between pulses time runs on the loop's estimate, but never past the next pulse
+    """
+
+    PPQN = 24
+    alpha = 0.1         # phase gain: the share of each pulse's timing error that corrects the phase
+    beta = 0.0025       # frequency gain: the share that corrects the period (alpha ** 2 / 4, critically damped)
+    dropout = 4         # a pulse this many periods late means the clock paused, so relock instead of bending the tempo
+
+    def __init__(self, driver, t=0.0):
+        self.driver = driver
+        self.period = None
+        self.reset(t)
+
+    def reset(self, t=0.0):
+        self.running = True
+        self.starting = False
+        self.pulses = 0
+        self.pulse_t = None     # loop's estimate of when the last pulse arrived, None until locked
+        self.origin = None      # driver cycles at pulse 0
+
+    def pulse(self):
+        """Called from MIDI input for each timing clock message, so cheap enough for the rtmidi callback thread"""
+        t = time.perf_counter()
+        if not self.running:
+            return
+        driver = self.driver
+        if self.pulse_t is None or t - self.pulse_t > self.dropout * self.period:
+            if self.period is None:
+                self.period = 1.0 / (4 * self.PPQN * driver.rate)
+            self.origin = driver._cycles - driver.lookahead * driver._tick_rate
+            self.pulses = 0
+            self.pulse_t = t
+            if self.starting:
+                self.starting = False
+                self.restart()
+            return
+        predicted = self.pulse_t + self.period
+        error = t - predicted
+        self.period = max(self.period + self.beta * error, 1e-4)
+        self.pulse_t = predicted + self.alpha * error
+        self.pulses += 1
+        driver.rate = 1.0 / (4 * self.PPQN * self.period)
+
+    def start(self):
+        """MIDI start: the next pulse is the downbeat, so threads restart from the top on it"""
+        self.starting = True
+        self.running = True
+        self.pulse_t = None
+
+    def stop(self):
+        """MIDI stop: hold time where it is and silence the threads"""
+        self.running = False
+        with self.driver._lock:
+            for thread in self.driver.threads:
+                if thread._running:
+                    thread.end()
+
+    def resume(self):
+        """MIDI continue: carry on from where time was held on the next pulse"""
+        self.running = True
+        self.pulse_t = None
+
+    def restart(self):
+        with self.driver._lock:
+            for thread in self.driver.threads:
+                if thread._running:
+                    thread.start()
+
+    def tempo(self):
+        """The locked tempo in bpm, or None if not locked"""
+        if self.period is None:
+            return None
+        return 60.0 / (self.PPQN * self.period)
+
+    def now(self):
+        driver = self.driver
+        pulse_t, period, pulses, origin = self.pulse_t, self.period, self.pulses, self.origin
+        if not self.running or pulse_t is None or driver._tick_rate <= 0:
+            return driver.t - driver.lookahead
+        position = pulses + min(max((time.perf_counter() - pulse_t) / period, 0.0), 1.0)
+        cycles = origin + position / (4 * self.PPQN) + driver.lookahead * driver._tick_rate
+        return driver.t - driver.lookahead + (cycles - driver._cycles) / driver._tick_rate
+
+
+class ClockOut(threading.Thread):
+    """Sends 24ppqn MIDI clock, start, continue and stop for the driver on a MidiOut port, so downstream gear can follow
+       Pulses are timed from driver.rate and driver._cycles on their own schedule rather than on the driver's ticks,
+       and are queued slightly early with a timestamp so the port sends them exactly on time
+       Start goes out just before the pulse on the next cycle boundary, which receivers take as their downbeat,
+       and playing again after a pause sends continue instead, so they carry on from where they were held
+       A render stops receivers before it captures the ports, and they start again when it's done
+    """
+
+    PPQN = 24
+    lead = 0.005        # queue each pulse this many seconds before it is due
+    poll = 0.01         # longest wait before checking on the driver again
+
+    def __init__(self, driver, port):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.driver = driver
+        self.port = port
+        self.pulse = None       # index of the next pulse, in driver cycles * 96, or None when stopped
+        self.cue = None         # START or CONTINUE, to go out before the next pulse
+        self.held = False       # receivers were stopped by a pause, so continue rather than start
+        self.rewound = False    # unless the driver was stopped since
+        self.start()
+
+    def rewind(self):
+        """Start receivers from the top the next time the driver plays, rather than continuing"""
+        self.rewound = True
+
+    def halt(self):
+        """Stop receivers if they are running, so they continue from here when the driver plays on"""
+        port = self.port
+        if port is None:        # being replaced, and run() sends the stop as it finishes
+            return
+        if self.pulse is not None and self.cue is None:
+            port.push([STOP])
+            self.held = True
+        self.pulse = self.cue = None
+
+    def run(self):
+        port = self.port
+        while self.port is port:
+            with self.driver._lock:     # renders hold this while they capture the ports, so nothing here gets captured
+                wait = self.send(port)
+            if wait:
+                time.sleep(wait)
+        with self.driver._lock:
+            if self.pulse is not None and self.cue is None:
+                port.push([STOP])
+
+    def send(self, port):
+        """Queue whatever is due on port, returning how long to wait before checking again"""
+        driver = self.driver
+        if not driver.running:
+            self.halt()
+            return self.poll
+        t, cycles, rate, now = driver.t, driver._cycles, driver.rate, driver.now()
+        if rate <= 0:
+            return self.poll
+        pulses_per_cycle = 4 * self.PPQN
+        if self.pulse is None:
+            if self.held and not self.rewound:
+                self.pulse = math.ceil(cycles * pulses_per_cycle)
+                self.cue = CONTINUE
+            else:                   # receivers count from the first pulse after a start
+                self.pulse = math.ceil(cycles) * pulses_per_cycle
+                self.cue = START
+            self.held = self.rewound = False
+        due = time.perf_counter() + t + (self.pulse / pulses_per_cycle - cycles) / rate - now
+        delay = due - time.perf_counter() - self.lead
+        if delay > 0:
+            return min(delay, self.poll)
+        if self.cue is not None:
+            port.push([self.cue], due)
+            self.cue = None
+        port.push([TIMING_CLOCK], due)
+        self.pulse += 1
+        return 0
@@ -0,0 +1,92 @@
+try:
+    import numpy
+except ImportError as e:
+    numpy = None
+
+
+class ThreadTable(object):
+    """Per-thread timing state kept in parallel columns, so the driver can find the threads whose step edge
+       has passed with one pass over all of them per tick instead of a full update of each
+       Each row repeats Thread.update's edge test on the thread's own state with the same arithmetic,
+       so the threads it leaves out are exactly those whose update would have done nothing
+       Vectorized with numpy when it's installed, otherwise a plain loop
+    """
+
+    columns = ('cycles', 'driver_cycles', 'tick_rate', 'phase', 'correction', 'divisions', 'lo', 'hi', 'single', 'last_edge', 'always', 'idle')
+    types = (float, float, float, float, float, int, int, int, bool, int, bool, bool)
+
+    def __init__(self):
+        self.threads = []
+        self.rows = {}
+        self.micro = {}     # row -> micro function, for the threads that have one
+        for column in self.columns:
+            setattr(self, column, [])
+
+    def build(self, threads):
+        self.micro = {}
+        self.threads = list(threads)
+        self.rows = {thread: row for row, thread in enumerate(self.threads)}
+        rows = [self._row(thread) for thread in self.threads]
+        for i, (column, kind) in enumerate(zip(self.columns, self.types)):
+            values = [row[i] for row in rows]
+            setattr(self, column, numpy.array(values, dtype=kind) if numpy is not None else values)
+        for row, thread in enumerate(self.threads):
+            self._set_micro(row, thread, rows[row])
+
+    def sync(self, thread):
+        """Copy a thread's state into its row, after it updates"""
+        row = self.rows[thread]
+        values = self._row(thread)
+        for column, value in zip(self.columns, values):
+            getattr(self, column)[row] = value
+        self._set_micro(row, thread, values)
+
+    def _set_micro(self, row, thread, values):
+        always, idle = values[-2:]
+        if not (always or idle) and thread.micro is not None:
+            self.micro[row] = thread.micro
+        else:
+            self.micro.pop(row, None)
+
+    def _row(self, thread):
+        if not thread._running:
+            return 0.0, 0.0, 0.0, 0.0, 0.0, 1, 0, 0, False, 0, False, True
+        if thread._continuous():
+            return 0.0, 0.0, 0.0, 0.0, 0.0, 1, 0, 0, False, 0, True, False
+        steps = thread._steps
+        lo, hi = steps.span(thread._index) if thread._index >= 0 else (0, 0)   # the subdivisions the current step covers
+        return (thread._cycles, thread._driver_cycles, thread._tick_rate, thread.phase, thread._phase_correction,
+                steps.divisions, lo, hi, len(steps) == 1, thread._last_edge, False, False)
+
+    def due(self, driver_cycles):
+        """Threads that cross a step edge (or always update) at the given driver cycles"""
+        if numpy is not None:
+            return self._due_vectorized(driver_cycles)
+        due = []
+        micro = self.micro
+        for row, (cycles, driver, rate, phase, correction, divisions, lo, hi, single, last_edge, always, idle) in enumerate(zip(
+                self.cycles, self.driver_cycles, self.tick_rate, self.phase, self.correction, self.divisions, self.lo, self.hi,
+                self.single, self.last_edge, self.always, self.idle)):
+            if idle:
+                continue
+            if always:
+                due.append(self.threads[row])
+                continue
+            cycles = cycles + (driver_cycles - driver) * rate
+            base = (cycles + phase + correction) % 1.0
+            if row in micro:
+                base = micro[row](base)
+            division = int(base * divisions)
+            if division < lo or division >= hi or (single and int(cycles) != last_edge):
+                due.append(self.threads[row])
+        return due
+
+    def _due_vectorized(self, driver_cycles):
+        cycles, driver, rate, phase, correction, divisions, lo, hi, single, last_edge, always, idle = [getattr(self, column) for column in self.columns]
+        cycles = cycles + (driver_cycles - driver) * rate
+        base = (cycles + phase + correction) % 1.0
+        for row, micro in self.micro.items():
+            base[row] = micro(base[row])
+        division = (base * divisions).astype(int)
+        crossed = (division < lo) | (division >= hi) | (single & (cycles.astype(int) != last_edge))
+        return [self.threads[row] for row in numpy.nonzero((crossed | always) & ~idle)[0]]
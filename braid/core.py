@@ -1,9 +1,83 @@
 #!/usr/bin/env python3
 
-import sys, time, threading, queue, __main__, atexit
-from .midi import midi_in
+import sys, time, math, heapq, itertools, collections, threading, queue, __main__, atexit
+from .midi import midi_in, midi_out, router, MidiOut, write_midi_file
+from .clock import Clock, RealtimeClock, VirtualClock, MidiClock, ClockOut
+from .compact import ThreadTable
+from .profiling import profiler
+from . import num_args
 
 LIVECODING = not hasattr(__main__, "__file__")
+EDGE_MARGIN = 1e-6     # wake this long after a predicted edge so rounding can't leave it uncrossed
+
+class Triggers(object):
+    """Trigger functions waiting in a heap keyed by the cycle position they fire at,
+       so adding and firing are O(log n) and only the soonest is looked at on each update
+       Entries are [position, sequence, f, period, repeat], where repeat is True or the number of firings left
+    """
+
+    sequence = itertools.count()    # so that triggers due at the same position fire in the order they were added
+
+    def __init__(self):
+        self.heap = []
+
+    def __len__(self):
+        return len(self.heap)
+
+    def next(self):
+        """Position of the soonest trigger, or None"""
+        return self.heap[0][0] if self.heap else None
+
+    def add(self, f, position, period, repeat):
+        heapq.heappush(self.heap, [position, next(self.sequence), f, period, repeat])
+
+    def cancel(self, repeating=False):
+        """Drop every trigger, or only those repeating forever"""
+        if repeating:
+            self.heap = [trigger for trigger in self.heap if trigger[4] is not True]
+            heapq.heapify(self.heap)
+        else:
+            self.heap = []
+
+    def fire(self, position, owner=None):
+        """Call each trigger due by the given position (with owner, if it takes an argument), and reschedule repeats"""
+        c = time.perf_counter() if profiler.enabled else None
+        while self.heap and self.heap[0][0] <= position:
+            trigger = heapq.heappop(self.heap)
+            f, period, repeat = trigger[2:]
+            try:
+                if owner is not None and num_args(f):
+                    f(owner)
+                else:
+                    f()
+            except Exception as e:
+                print("\n[Trigger error: %s]" % e)
+            if repeat is True or repeat > 1:
+                trigger[0] += period
+                trigger[1] = next(self.sequence)
+                trigger[4] = repeat if repeat is True else repeat - 1
+                heapq.heappush(self.heap, trigger)
+        if c is not None:
+            profiler.record('triggers', time.perf_counter() - c)
+
+    @staticmethod
+    def schedule(owner, f, cycles, repeat, position):
+        """Parse the arguments to trigger() for a thread or the driver at the given cycle position"""
+        if f is None and repeat is False:
+            owner._triggers.cancel(repeating=True)
+        elif f is False:
+            owner._triggers.cancel()
+        else:
+            try:
+                assert(callable(f))
+                assert(cycles >= 0)
+                if cycles == 0:
+                    assert repeat == 0
+            except AssertionError as e:
+                print("\n[Bad arguments for trigger]")
+            else:
+                owner._triggers.add(f, math.floor(position) + 1 + cycles, cycles, repeat)     # from the end of the current cycle
+
 
 class Driver(threading.Thread):
 
@@ -12,15 +86,31 @@ class Driver(threading.Thread):
         self.daemon = True
         self.threads = []
         self.grain = 0.01
+        self.scheduled = False      # only update threads at their step edges, sleeping in between
+        self.compact = False        # poll every tick, but find the threads at a step edge from a table of their timing state
+        self.max_sleep = 0.1
+        self.lookahead = 0.0        # render steps this many seconds ahead and timestamp their MIDI
+        self.rendering = False
+        self._clock = RealtimeClock()
+        self._clock_out = None
         self.t = 0.0
         self.rate = 1.0
         self.previous_t = 0.0
-        self.previous_cycles = 0
         self.running = False
         self._cycles = 0.0
-        self._triggers = []
+        self._tick_rate = self.rate    # rate the current tick integrates at, so rate changes apply from the tick they're seen
+        self._triggers = Triggers()
+        self.tweens = []                # active tweens, advanced once per tick
+        self._wake = threading.Event()
+        self._edges = []                # heap of (time, sequence, thread) for scheduled mode
+        self._sequence = itertools.count()
+        self._rescheduled = collections.deque()
+        self._updating = None
+        self._table = None
+        self._lock = threading.Lock()  # held for each realtime tick, and for the whole of an offline render
 
     def start(self):
+        open_ports()    # here rather than on the first message, which would open them inside a tick
         super(Driver, self).start()
         print("-------------> O")
         if not LIVECODING:
@@ -31,76 +121,227 @@ class Driver(threading.Thread):
                 driver.stop()
 
     def run(self):
-        self.start_t = time.time()
+        self.clock.reset()
+        self._tick_rate = self.rate     # nothing has been integrated at any other rate yet
         while True:
-            self.t = time.time() - self.start_t
-            if self.running:                                
-                try:
-                    if not self.running:
-                        break
-                    midi_in.perform_callbacks()
-                    delta_t = self.t - self.previous_t
-                    self._cycles += delta_t * self.rate
-                    if int(self._cycles) != self.previous_cycles:
-                        self.update_triggers()
-                        self.previous_cycles = int(self._cycles)
-                    for thread in self.threads:
-                        c = time.time()
-                        try:
-                            thread.update(delta_t)
-                        except Exception as e:
-                            print("\n[Error: \"%s\"]" % e)
-                            thread.stop()
-                            raise e
-                        rc = int((time.time() - c) * 1000)
-                        if rc > 1:
-                            print("[Warning: update took %dms]\n>>> " % rc, end='')
-                except KeyboardInterrupt:
-                    self.stop()
-            elif not LIVECODING:
-                break
-            self.previous_t = self.t     
-            time.sleep(self.grain)                
+            with self._lock:
+                self.t = max(self.now() + self.lookahead, self.previous_t)
+                if self.running:                                
+                    try:
+                        if not self.running:
+                            break
+                        if profiler.enabled:
+                            c = time.perf_counter()
+                            self.update(self.t - self.previous_t)
+                            profiler.record_tick(time.perf_counter() - c, self.grain, router.pending())
+                        else:
+                            self.update(self.t - self.previous_t)
+                    except KeyboardInterrupt:
+                        self.stop()
+                elif not LIVECODING:
+                    break
+                self.previous_t = self.t     
+            if self.scheduled and self.running:
+                self.sleep_until(self.next_edge())
+            else:
+                self.sleep_until(self.t + self.grain)
 
-    def trigger(self, f=None, cycles=0, repeat=0):
-        if f is None and repeat is False:
-            self._triggers = [trigger for trigger in self._triggers if trigger[2] is not True]  # filter repeat=True
-        elif f is False:
-            self._triggers = []
+    @property
+    def clock(self):
+        return self._clock
+
+    @clock.setter
+    def clock(self, clock):
+        self._clock = clock
+        self.wake()
+
+    @property
+    def clock_out(self):
+        """The MidiOut port that MIDI clock, start and stop are sent to, or None"""
+        return self._clock_out.port if self._clock_out is not None else None
+
+    @clock_out.setter
+    def clock_out(self, port):
+        if self._clock_out is not None:
+            self._clock_out.port = None     # its thread sends stop and exits
+        self._clock_out = ClockOut(self, port) if port is not None else None
+
+    def now(self):
+        """Seconds since the driver started, from its clock"""
+        return self.clock.now()
+
+    def update(self, delta_t):
+        """Advance the driver by delta_t seconds and update the threads that are due"""
+        self.stamp()
+        midi_in.perform_callbacks()
+        self._cycles += delta_t * self._tick_rate
+        if self.rate != self._tick_rate:
+            self._edges = []    # predicted at the old rate, so have every thread work out its next edge again
+        self._tick_rate = self.rate
+        if self._triggers.heap and self._triggers.heap[0][0] <= self._cycles:
+            self._triggers.fire(self._cycles)
+        if self.scheduled:
+            self._table = None
+            self.update_scheduled()
+        elif self.compact:
+            self._edges = []
+            self.update_compact()
         else:
+            self._edges = []
+            self._table = None
+            self._rescheduled.clear()
+            for thread in self.threads:
+                self.update_thread(thread)
+        self.update_tweens()
+
+    def update_scheduled(self):
+        """Update the threads whose predicted step edge has come, and any that asked to be rescheduled"""
+        due = [] if self._edges else list(self.threads)   # switching into scheduled mode, update everything once
+        while self._edges and self._edges[0][0] <= self.t:
+            t, n, thread = heapq.heappop(self._edges)
+            if thread._edge == t:   # otherwise superseded by a reschedule
+                due.append(thread)
+        while self._rescheduled:
+            due.append(self._rescheduled.popleft())
+        updated = set()
+        for thread in due:
+            if thread in updated:
+                continue
+            updated.add(thread)
+            self.update_thread(thread)
+            thread._edge = thread.next_edge()
+            if thread._edge is not None:
+                heapq.heappush(self._edges, (thread._edge, next(self._sequence), thread))
+
+    def update_compact(self):
+        """Check every thread's step edge at once from the thread table, and only update those that crossed one"""
+        if self._table is None or self._table.threads != self.threads:     # switching in, or threads were added
+            self._table = ThreadTable()
+            self._table.build(self.threads)
+        due = self._table.due(self._cycles)
+        while self._rescheduled:
+            due.append(self._rescheduled.popleft())
+        updated = set()
+        for thread in due:
+            if thread in updated:
+                continue
+            updated.add(thread)
+            self.update_thread(thread)
+            self._table.sync(thread)
+
+    def update_tweens(self):
+        """Advance each active tween once, so it ends and turns around without having to be read,
+           and drop the finished ones, putting their target values back in their place
+        """
+        for tween in list(self.tweens):
+            if not tween.attached:      # replaced by another value
+                self.tweens.remove(tween)
+                continue
+            tween.advance()
+            if tween.finished:
+                self.tweens.remove(tween)
+                tween.detach()
+
+    def update_thread(self, thread):
+        c = time.perf_counter()
+        self._updating = thread
+        try:
+            thread.update(self.t - thread._t)
+        except Exception as e:
+            print("\n[Error: \"%s\"]" % e)
+            thread.stop()
+            raise e
+        finally:
+            self._updating = None
+            thread._t = self.t
+        elapsed = time.perf_counter() - c
+        if profiler.enabled:
+            profiler.record_thread(thread, elapsed)
+        rc = int(elapsed * 1000)
+        if rc > 1:
+            print("[Warning: update took %dms]\n>>> " % rc, end='')
+
+    def next_edge(self):
+        """Driver time of the earliest scheduled thread edge (or universal trigger edge)"""
+        t = self.t + self.max_sleep
+        if midi_in.callbacks or midi_in.threads:
+            t = self.t + self.grain     # keep draining MIDI input at the usual resolution
+        if self._triggers.heap and self.rate > 0:
+            t = min(t, self.t + (self._triggers.next() - self._cycles) / self.rate + EDGE_MARGIN)
+        if self._edges and self._edges[0][0] < t:
+            t = self._edges[0][0]
+        return t
+
+    def reschedule(self, thread):
+        """Have a thread updated on the next tick, eg after its timing or controls change"""
+        if thread is self._updating:    # it will be rescheduled when its update finishes
+            return
+        self._rescheduled.append(thread)
+        self.wake()
+
+    def render(self, cycles):
+        """Run the threads for the given number of cycles as fast as possible, returning timestamped MIDI messages"""
+        with self._lock:
+            t, previous_t, scheduled, clock = self.t, self.previous_t, self.scheduled, self.clock
+            if self._clock_out is not None:     # time moves on without them, so receivers start again afterwards
+                self._clock_out.halt()
+                self._clock_out.rewind()
+            events = router.capture = []
+            self.rendering = self.scheduled = True
+            self.clock = VirtualClock(t)
             try:
-                assert(callable(f))
-                if cycles == 0:
-                    assert repeat == 0
-            except AssertionError as e:
-                print("\n[Bad arguments for trigger]")
-            else:
-                self._triggers.append([f, cycles, repeat, 0])   # last parameter is cycle edges so far                
-
-    def update_triggers(self):
-        """Check trigger functions a fire as necessary"""
-        updated = False
-        for t, trigger in enumerate(self._triggers):
-            trigger[3] += 1                             # increment edge
-            if trigger[1] - trigger[3] == 0: 
-                try:
-                    trigger[0]()
-                except Exception as e:
-                    print("\n[Error: %s]" % e)
-                if trigger[2] is True:
-                    self.trigger(trigger[0], trigger[1], True)                  # create new trigger with same properties
-                else:
-                    trigger[2] -= 1
-                    if trigger[2] > 0:
-                        print("\n[Made new trigger with %s]" % trigger[2])
-                        self.trigger(trigger[0], trigger[1], trigger[2] - 1)    # same, but decrement repeats
-                self._triggers[t] = None                                         # clear this trigger
-                updated = True
-        if updated:
-            self._triggers = [trigger for trigger in self._triggers if trigger is not None]
+                end_cycles = self._cycles + cycles
+                self.update(0.0)    # pick up the current rates and schedule every thread from here
+                while self._cycles < end_cycles:
+                    self.clock.sleep_until(self.next_edge(), self._wake)
+                    self.previous_t, self.t = self.t, self.clock.now()
+                    self.update(self.t - self.previous_t)
+                for thread in self.threads:
+                    if thread._running:
+                        thread.end()
+            finally:
+                router.capture = None
+                self.rendering = False
+                self.scheduled = scheduled
+                self.clock = clock
+                self.t, self.previous_t = t, previous_t
+                for thread in self.threads:
+                    thread._t = t
+                self.stamp()
+        return [(stamp - t, message) for (stamp, message) in events]
+
+    @property
+    def stamping(self):
+        """Whether outgoing MIDI is timestamped (when rendering ahead or offline)"""
+        return self.lookahead or self.rendering
+
+    def stamp(self, t=None):
+        """Timestamp outgoing MIDI to go out at driver time t (default: the current tick) when rendering ahead"""
+        if self.rendering:
+            router.timestamp = self.t if t is None else t
+        elif self.lookahead:
+            router.timestamp = time.perf_counter() + (self.t if t is None else t) - self.clock.now()
+        else:
+            router.timestamp = None
+
+    def sleep_until(self, t):
+        """Block until driver time t, returning early if woken"""
+        self.clock.sleep_until(t - self.lookahead, self._wake)
+
+    def wake(self):
+        """Interrupt a scheduled sleep so that edges are recomputed (eg, after a rate change)"""
+        self._wake.set()
+
+    def trigger(self, f=None, cycles=0, repeat=0):
+        """Call f at the end of the current universal cycle, after waiting the given number of complete cycles (fractions too),
+           repeating it every that many cycles forever (repeat=True) or until it has been called repeat times
+        """
+        Triggers.schedule(self, f, cycles, repeat, self._cycles)
 
     def stop(self):
         self.running = False
+        if self._clock_out is not None:
+            self._clock_out.rewind()
         for thread in self.threads:
             if thread._running:
                 thread.stop()
@@ -111,6 +352,10 @@ def tempo(value=False):
         value /= 60.0
         value /= 4.0
         driver.rate = value
+        if not driver.running and not driver.rendering:
+            driver._tick_rate = value   # no tick to see the change, so the next one doesn't integrate at the old rate
+            driver._edges = []
+        driver.wake()
     else:
         return driver.rate * 4.0 * 60.0
 
@@ -118,11 +363,32 @@ def rate(value=False):
     """Cycles in hz"""
     if value:
         driver.rate = value
+        if not driver.running and not driver.rendering:
+            driver._tick_rate = value
+            driver._edges = []
+        driver.wake()
     else:
         return driver.rate
 
+def open_ports():
+    """Open the MIDI ports that aren't open yet, and give them a moment to settle"""
+    ports = [port for port in router.ports + [midi_in] if not port._opened]
+    if not ports:
+        return
+    for port in ports:
+        port.open()
+    time.sleep(0.5)
+    print("MIDI ready")
+
+def init():
+    """Open the MIDI ports now rather than when the driver starts, and when livecoding start playing"""
+    open_ports()
+    if LIVECODING and not driver.is_alive():
+        play()
+
 def play():
     driver.running = True
+    driver.wake()
     if not driver.is_alive():
         driver.start()
     print("[Playing]")
@@ -137,6 +403,37 @@ def stop():
     driver.stop()
     print("[Stopped]")
 
+def sync(value=True):
+    """Follow external MIDI clock, start, stop and continue on the MIDI input, or go back to the internal clock"""
+    if value:
+        driver.clock = MidiClock(driver)
+        midi_in.follow(driver.clock)
+        print("[Following MIDI clock]")
+    else:
+        midi_in.follow(None)
+        driver.clock = RealtimeClock(driver.t - driver.lookahead)
+        print("[Internal clock]")
+
+def profile(value=True, every=None):
+    """Start recording where the driver's time goes, optionally printing a report every so many seconds,
+       or stop and print what was recorded
+    """
+    if value:
+        profiler.reset()
+        profiler.every = every
+        profiler.enabled = True
+        print("[Profiling]")
+    else:
+        profiler.enabled = False
+        profiler.report()
+
+def render(filename, cycles):
+    """Render the given number of cycles to a Standard MIDI File, as fast as possible"""
+    bpm = tempo()
+    events = driver.render(cycles)
+    write_midi_file(filename, events, bpm)
+    print("[Rendered %s cycles to %s]" % (cycles, filename))
+
 def clear():
     for thread in driver.threads:
         if thread._running:
@@ -144,6 +441,8 @@ def clear():
     print("[Cleared]")
 
 def exit_handler():
+    if driver.ident is None:    # never started, so nothing to wind down
+        return
     driver.stop()
     time.sleep(0.1) # for midi to finish               
     print("\n-------------> X")    
@@ -1,40 +1,41 @@
-try:
-    from . import Anode, Triode, VolcaKick, VolcaBeats, VolcaDrum, midi_out, midi_clamp
-except ImportError as e:
-    print("Custom Threads failed: %s" % e)
-else:
-
-    from braid.notation import *
-
-    """
-    Volcas dont respond to note velocity, unfortunately, but we can simulate it with these customizations.
-
-    Would rather not have this in the module itself, but so be it.
-
-    """
-
-    def note(self, pitch, velocity):
-        midi_out.send_note(self._channel, self._previous_pitch, 0)
-        midi_out.send_control(self._channel, 44, midi_clamp(velocity * 127))            
-        midi_out.send_note(self._channel, pitch, 127)
-        self._previous_pitch = pitch
-    VolcaKick.note = note
-
-
-    def note(self, pitch, velocity):
-        if pitch == 36:
-            velocity /= 3.0
-        try:
-            midi_out.send_control(self._channel, DRM.index(pitch - 36) + 40, midi_clamp(velocity * 127))
-        except ValueError:
-            print("(warning: note doesn't exist)")
-        midi_out.send_note(self._channel, pitch, 127)
-        self._previous_pitch = pitch
-    VolcaBeats.note = note
-
-
-    def note(self, pitch, velocity):
-        midi_out.send_control(self._channel, 19, midi_clamp(velocity * 127))            
-        midi_out.send_note(self._channel, pitch, 127)
-        self._previous_pitch = pitch
-    VolcaDrum.note = note
\ No newline at end of file
+from .notation import *
+from .thread import midi_clamp
+
+"""
+Volcas dont respond to note velocity, unfortunately, but we can simulate it with these customizations.
+
+Would rather not have this in the module itself, but so be it.
+
+They're applied to the synth Threads of the same name when those are first made.
+
+"""
+
+def volca_kick_note(self, pitch, velocity):
+    self.port.send_note(self._channel, self._previous_pitch, 0)
+    self.port.send_control(self._channel, 44, midi_clamp(velocity * 127))            
+    self.port.send_note(self._channel, pitch, 127)
+    self._previous_pitch = pitch
+
+
+def volca_beats_note(self, pitch, velocity):
+    if pitch == 36:
+        velocity /= 3.0
+    try:
+        self.port.send_control(self._channel, DRM.index(pitch - 36) + 40, midi_clamp(velocity * 127))
+    except ValueError:
+        print("(warning: note doesn't exist)")
+    self.port.send_note(self._channel, pitch, 127)
+    self._previous_pitch = pitch
+
+
+def volca_drum_note(self, pitch, velocity):
+    self.port.send_control(self._channel, 19, midi_clamp(velocity * 127))            
+    self.port.send_note(self._channel, pitch, 127)
+    self._previous_pitch = pitch
+
+
+customizations = {
+    'VolcaKick': {'note': volca_kick_note},
+    'VolcaBeats': {'note': volca_beats_note},
+    'VolcaDrum': {'note': volca_drum_note},
+}
@@ -1,33 +1,165 @@
 #!/usr/bin/env python3
 
-import sys, time, threading, atexit, queue, rtmidi
-from rtmidi.midiconstants import NOTE_ON, NOTE_OFF, CONTROLLER_CHANGE
+import sys, time, struct, threading, atexit, heapq, itertools, array
 from . import num_args
+from .profiling import profiler
+try:
+    import rtmidi
+except ImportError as e:
+    rtmidi = None
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+CONTROLLER_CHANGE = 0xB0
+TIMING_CLOCK = 0xF8
+START = 0xFA
+CONTINUE = 0xFB
+STOP = 0xFC
 
 log_midi = False
 
+
+class NullMidi(object):
+    """Stand-in for an rtmidi port that discards everything, for benchmarks or when rtmidi isn't available"""
+
+    def get_ports(self):
+        return []
+
+    def open_port(self, port):
+        pass
+
+    def open_virtual_port(self, name):
+        pass
+
+    def set_callback(self, f):
+        pass
+
+    def ignore_types(self, sysex=True, timing=True, active_sense=True):
+        pass
+
+    def send_message(self, message):
+        pass
+
+
+class RecordingMidi(NullMidi):
+    """Stand-in port that keeps every message sent along with its perf_counter time"""
+
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, message):
+        self.messages.append((time.perf_counter(), message))
+
+
+def write_midi_file(filename, events, bpm, resolution=480):
+    """Write (seconds, message) events to a single-track Standard MIDI File at a constant tempo"""
+
+    def varlen(value):
+        data = [value & 0x7F]
+        value >>= 7
+        while value:
+            data.insert(0, (value & 0x7F) | 0x80)
+            value >>= 7
+        return data
+
+    ticks_per_second = resolution * bpm / 60.0
+    tempo = int(round(60000000 / bpm))
+    track = [0x00, 0xFF, 0x51, 0x03, (tempo >> 16) & 0xFF, (tempo >> 8) & 0xFF, tempo & 0xFF]
+    previous = 0
+    status = None   # running status: channel messages with the same status byte as the last can leave it out
+    for t, message in sorted(events, key=lambda event: event[0]):
+        if 0xF0 < message[0] < 0xFF:     # clock, transport and other system messages have no place in a file
+            continue
+        tick = max(int(round(t * ticks_per_second)), previous)
+        track.extend(varlen(tick - previous))
+        if message[0] == status:
+            track.extend(message[1:])
+        elif message[0] == 0xF0:        # sysex is stored with its length
+            track.append(0xF0)
+            track.extend(varlen(len(message) - 1))
+            track.extend(message[1:])
+            status = None
+        else:                           # channel messages, and meta events given as [0xFF, type, length, data...]
+            track.extend(message)
+            status = message[0] if message[0] < 0xF0 else None
+        previous = tick
+    track.extend([0x00, 0xFF, 0x2F, 0x00])
+    with open(filename, 'wb') as f:
+        f.write(b'MThd' + struct.pack('>IHHH', 6, 0, 1, resolution))
+        f.write(b'MTrk' + struct.pack('>I', len(track)) + bytes(track))
+
+
+def interface_arg(index):
+    """The MIDI interface index given at that position on the command line, or 0"""
+    try:
+        return int(sys.argv[index])
+    except (IndexError, ValueError):
+        return 0
+
+
 class MidiOut(threading.Thread):
 
-    def __init__(self, interface=0, throttle=0):
+    def __init__(self, interface=0, throttle=0, backend=None, lazy=False):
         threading.Thread.__init__(self)
         self.daemon = True
         self._interface = interface  
-        self.throttle = throttle
-        self.queue = queue.Queue()
-        self.midi = rtmidi.MidiOut()            
+        self.throttle = throttle    # minimum seconds between messages on this port
+        self.elide = True           # drop note offs for notes that aren't on, and CCs that already have that value
+        self.running_status = False # leave out repeated status bytes, only for backends that take raw bytes (eg, a serial DIN port)
+        self.timestamp = None   # perf_counter time at which subsequent messages should be sent, None for immediately
+        self.capture = None     # list to collect (timestamp, message) into instead of sending, for offline rendering
+        self._events = []       # heap of (time, sequence, message, automation)
+        self._sequence = itertools.count()  # keeps messages with the same timestamp in order
+        self._condition = threading.Condition()
+        self._next_send = 0.0
+        self.sent = 0           # stats: messages sent, superseded CCs never sent, and how late messages went out
+        self.superseded = 0
+        self.late = 0.0
+        self.max_late = 0.0
+        self.elided = 0
+        self._start_t = time.perf_counter()
+        self._notes = set()     # (channel, pitch) of the notes sounding on this port
+        self._controls = {}     # (status, control) -> last value sent
+        self._status = None     # last status byte sent, for running status
+        self.midi = backend
+        self._opened = False
+        self._open_lock = threading.RLock()   # scan() opens too, from inside open()
+        if not lazy:
+            self.open()
+
+    def open(self):
+        """Open the port and start sending, if it isn't already (otherwise this happens when the driver starts)"""
+        with self._open_lock:
+            if self._opened:
+                return
+            self._opened = True
+            if self._interface is None:
+                self._interface = interface_arg(1)
+            if self.midi is None and rtmidi is None:
+                print("[rtmidi not available, MIDI OUT disabled]")
+                self.midi = NullMidi()
+            if self.midi is None:
+                self.midi = rtmidi.MidiOut()
+                if not self._connect():
+                    return
+            self.start()
+
+    def _connect(self):
+        """Open the rtmidi port on the current interface, or a virtual one if there are none"""
         available_interfaces = self.scan()
         if available_interfaces:
             if self._interface >= len(available_interfaces):
                 print("Interface index %s not available" % self._interface)
-                return
+                return False
             print("MIDI OUT: %s" % available_interfaces[self._interface])
             self.midi.open_port(self._interface)
         else:
             print("MIDI OUT opening virtual interface 'Braid'...")
             self.midi.open_virtual_port('Braid')
-        self.start()   
+        return True
 
     def scan(self):
+        self.open()
         available_interfaces = self.midi.get_ports()
         if len(available_interfaces):
             print("MIDI outputs available: %s" % available_interfaces)
@@ -35,11 +167,55 @@ class MidiOut(threading.Thread):
             print("No MIDI outputs available")
         return available_interfaces
 
-    def send_control(self, channel, control, value):
-        self.queue.put((channel, (control, value), None))
+    def send_control(self, channel, control, value, automation=False):
+        """Send a CC; automation=True lets a later value of the same control replace this one if both are waiting to go out"""
+        if type(value) == bool:
+            value = 127 if value else 0
+        self.push([CONTROLLER_CHANGE | ((channel - 1) & 0xF), control, value], automation=automation)
 
     def send_note(self, channel, pitch, velocity):
-        self.queue.put((channel, None, (pitch, velocity)))
+        channel = (channel - 1) & 0xF
+        if velocity:
+            self.push([NOTE_ON | channel, pitch & 0x7F, velocity & 0x7F])
+        else:
+            self.push([NOTE_OFF | channel, pitch & 0x7F, 0])
+
+    def push(self, message, t=None, automation=False):
+        """Queue a raw MIDI message to be sent at perf_counter time t, or else the current timestamp"""
+        if t is None:
+            t = time.perf_counter() if self.timestamp is None else self.timestamp
+        if self.capture is not None:
+            if self.elide and self._redundant(message, *self._captured):
+                self.elided += 1
+                return
+            self.capture.append((t, message))
+            return
+        if not self._opened:
+            self.open()
+        with self._condition:
+            heapq.heappush(self._events, (t, next(self._sequence), message, automation))
+            if self._events[0][2] is message:   # new earliest event, reschedule the sender
+                self._condition.notify()
+
+    def flush(self):
+        """Send everything that is waiting, due or not"""
+        with self._condition:
+            batch = [message for t, n, message, automation in sorted(self._events)]
+            self._events = []
+        self.send_batch(batch)
+
+    def pending(self):
+        """Number of messages waiting to be sent"""
+        return len(self._events)
+
+    @property
+    def capture(self):
+        return self._capture
+
+    @capture.setter
+    def capture(self, capture):
+        self._capture = capture
+        self._captured = set(), {}  # notes and CC values in the capture, elided against apart from what the port has sent
 
     @property
     def interface(self):
@@ -47,52 +223,224 @@ class MidiOut(threading.Thread):
 
     @interface.setter
     def interface(self, interface):
-        self.__init__(interface=interface, throttle=self.throttle)
+        """Switch interfaces, reopening the rtmidi port in place so the one sender carries on with what's queued"""
+        with self._open_lock:
+            self._interface = interface
+            if not self._opened or rtmidi is None or not isinstance(self.midi, rtmidi.MidiOut):
+                return
+            self.midi.close_port()
+            self.forget()   # a different device, which hasn't been sent anything
+            if self._connect() and self.ident is None:
+                self.start()
 
     def run(self):
         while True:
-            channel, control, note = self.queue.get()
-            if control is not None:
-                control, value = control
-                if type(value) == bool:
-                    value = 127 if value else 0
-                if log_midi:
-                    print("MIDI ctrl %s %s %s" % (channel, control, value))                    
-                channel -= 1
-                self.midi.send_message([CONTROLLER_CHANGE | (channel & 0xF), control, value])                
-            if note is not None:
-                pitch, velocity = note
-                if log_midi:
-                    print("MIDI note %s %s %s" % (channel, pitch, velocity))
-                channel -= 1
-                if velocity:            
-                    self.midi.send_message([NOTE_ON | (channel & 0xF), pitch & 0x7F, velocity & 0x7F])
+            with self._condition:
+                if not self._events:
+                    self._condition.wait()
+                    continue
+                delay = self._events[0][0] - time.perf_counter()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                batch = self._pop_due()
+            self.send_batch(batch)
+
+    def _pop_due(self):
+        """Pop every message that is due, keeping only the latest value of each automated CC
+           Other CCs all go out (eg, a sustain tap), as does an automated value with a note on its channel after it,
+           since it may be meant for that note
+        """
+        now = time.perf_counter()
+        batch = []
+        controls = {}   # channel -> {control: index in batch} of automated values, since that channel's last note
+        while self._events and self._events[0][0] <= now:
+            t, n, message, automation = heapq.heappop(self._events)
+            kind, channel = message[0] & 0xF0, message[0] & 0x0F
+            if kind == CONTROLLER_CHANGE:
+                pending = controls.setdefault(channel, {})
+                if not automation:
+                    pending.pop(message[1], None)
+                else:
+                    if message[1] in pending:
+                        batch[pending[message[1]]] = None     # superseded before it went out
+                        self.superseded += 1
+                    pending[message[1]] = len(batch)
+            elif kind == NOTE_ON or kind == NOTE_OFF:
+                controls.pop(channel, None)
+            batch.append(message)
+            self.late += now - t
+            self.max_late = max(self.max_late, now - t)
+            if profiler.enabled:
+                profiler.latency.add(now - t)
+        return batch
+
+    def stats(self):
+        """Throughput and timing of this port since it opened (or since the last reset_stats)"""
+        elapsed = time.perf_counter() - self._start_t
+        return {
+            'interface': self._interface,
+            'sent': self.sent,
+            'superseded': self.superseded,
+            'elided': self.elided,
+            'pending': self.pending(),
+            'rate': self.sent / elapsed if elapsed > 0 else 0.0,
+            'mean_late': self.late / self.sent if self.sent else 0.0,
+            'max_late': self.max_late,
+        }
+
+    def reset_stats(self):
+        self.sent = self.superseded = self.elided = 0
+        self.late = self.max_late = 0.0
+        self._start_t = time.perf_counter()
+
+    def forget(self):
+        """Assume nothing about what the receiving device has been sent, eg after it has been power cycled"""
+        self._notes.clear()
+        self._controls.clear()
+        self._status = None
+
+    def _redundant(self, message, notes, controls):
+        """Track what has gone out in notes and controls, and check whether the message would change anything"""
+        kind = message[0] & 0xF0
+        if kind == NOTE_ON and message[2] > 0:
+            notes.add((message[0] & 0xF, message[1]))
+        elif kind == NOTE_ON or kind == NOTE_OFF:
+            note = message[0] & 0xF, message[1]
+            if note not in notes:
+                return True
+            notes.discard(note)
+        elif kind == CONTROLLER_CHANGE:
+            control = message[0], message[1]
+            if controls.get(control) == message[2]:
+                return True
+            controls[control] = message[2]
+        return False
+
+    def _running_status(self, message):
+        """Leave out the status byte when it repeats, sending note offs as zero velocity note ons so they repeat more"""
+        status = message[0]
+        if status & 0xF0 == NOTE_OFF:
+            status = NOTE_ON | (status & 0xF)
+            message = [status, message[1], 0]
+        if status >= 0xF8:      # realtime messages go between others without affecting running status
+            return message
+        if status == self._status:
+            return message[1:]
+        self._status = status if status < 0xF0 else None
+        return message
+
+    def send_batch(self, batch):
+        for message in batch:
+            if message is None:
+                continue
+            if self.elide and self._redundant(message, self._notes, self._controls):
+                self.elided += 1
+                continue
+            if log_midi:
+                if len(message) == 1:
+                    if message[0] != TIMING_CLOCK:
+                        print("MIDI %s" % {START: "start", CONTINUE: "continue", STOP: "stop"}.get(message[0], hex(message[0])))
                 else:
-                    self.midi.send_message([NOTE_OFF | (channel & 0xF), pitch & 0x7F, 0])
-            if self.throttle > 0:
-                time.sleep(self.throttle)
+                    kind = "ctrl" if message[0] & 0xF0 == CONTROLLER_CHANGE else "note"
+                    print("MIDI %s %s %s %s" % (kind, (message[0] & 0xF) + 1, message[1], message[2]))
+            if self.throttle > 0:   # rate limit the port rather than sleeping after every message
+                delay = self._next_send - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                self._next_send = max(time.perf_counter(), self._next_send) + self.throttle
+            self.midi.send_message(self._running_status(message) if self.running_status else message)
+            self.sent += 1
+
+
+class RingBuffer(object):
+    """Fixed-size single-producer, single-consumer queue of timestamped MIDI events
+       Only the producer moves the tail and only the consumer moves the head, so neither side needs a lock,
+       and the slots are preallocated arrays, so pushing doesn't allocate; when full, new events are dropped and counted
+    """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.times = array.array('d', bytes(8 * size))
+        self.status = array.array('B', bytes(size))
+        self.data1 = array.array('B', bytes(size))
+        self.data2 = array.array('B', bytes(size))
+        self.head = 0       # next slot to read
+        self.tail = 0       # next slot to write
+        self.dropped = 0
+
+    def __len__(self):
+        return (self.tail - self.head) % self.size
+
+    def push(self, t, status, data1=0, data2=0):
+        tail = self.tail
+        following = (tail + 1) % self.size
+        if following == self.head:
+            self.dropped += 1
+            return False
+        self.times[tail] = t
+        self.status[tail] = status
+        self.data1[tail] = data1
+        self.data2[tail] = data2
+        self.tail = following       # publish only once the slot is written
+        return True
+
+    def pop(self):
+        """The oldest event as (t, status, data1, data2), or None if empty"""
+        head = self.head
+        if head == self.tail:
+            return None
+        event = self.times[head], self.status[head], self.data1[head], self.data2[head]
+        self.head = (head + 1) % self.size
+        return event
 
 
 class MidiIn(threading.Thread):
 
-    def __init__(self, interface=0):
+    def __init__(self, interface=0, backend=None, lazy=False):
         threading.Thread.__init__(self)
         self.daemon = True
         self._interface = interface          
-        self.queue = queue.Queue()
-        self.midi = rtmidi.MidiIn()
+        self.events = RingBuffer()      # CCs and notes from the rtmidi callback, handled on the driver's thread
         self.callbacks = {}
-        self.threads = []
+        self._threads = []
+        self.clock = None
+        self.midi = backend
+        self._opened = False
+        self._open_lock = threading.RLock()   # scan() opens too, from inside open()
+        if not lazy:
+            self.open()
+
+    def open(self):
+        """Open the port and start listening, if it isn't already (otherwise this happens when the driver starts)"""
+        with self._open_lock:
+            if self._opened:
+                return
+            self._opened = True
+            if self._interface is None:
+                self._interface = interface_arg(2)
+            if self.midi is None and rtmidi is None:
+                print("[rtmidi not available, MIDI IN disabled]")
+                self.midi = NullMidi()
+            if self.midi is None:
+                self.midi = rtmidi.MidiIn()
+                if not self._connect():
+                    return
+            self.start()
+
+    def _connect(self):
+        """Open the rtmidi port on the current interface, if there is one"""
         available_interfaces = self.scan()
         if available_interfaces:
             if self._interface >= len(available_interfaces):
                 print("Interface index %s not available" % self._interface)
-                return
+                return False
             print("MIDI IN: %s" % available_interfaces[self._interface])
             self.midi.open_port(self._interface)
-        self.start()           
-        
+        return True
+
     def scan(self):
+        self.open()
         available_interfaces = self.midi.get_ports()
         if 'Braid' in available_interfaces:
             available_interfaces.remove('Braid')
@@ -108,45 +456,169 @@ class MidiIn(threading.Thread):
 
     @interface.setter
     def interface(self, interface):
-        self.__init__(interface=interface)
+        """Switch interfaces, reopening the rtmidi port in place"""
+        with self._open_lock:
+            self._interface = interface
+            if not self._opened or rtmidi is None or not isinstance(self.midi, rtmidi.MidiIn):
+                return
+            self.midi.close_port()
+            if not self._connect():
+                return
+            if self.ident is None:
+                self.start()
+            else:       # closing the port dropped the callback
+                self.midi.set_callback(self._receive)
+                self.midi.ignore_types(timing=self.clock is None)
+
+    @property
+    def threads(self):
+        """Threads to play incoming notes on, indexed by MIDI channel"""
+        return self._threads
+
+    @threads.setter
+    def threads(self, threads):
+        self._threads = threads
+        if threads:
+            self.open()
 
     def run(self):
-        def receive_message(event, data=None):
-            message, deltatime = event
-            if message[0] & 0b11110000 == CONTROLLER_CHANGE:
-                nop, control, value = message
-                self.queue.put((control, value / 127.0))
-            elif (message[0] & 0b11110000 == NOTE_ON):
-                if len(message) < 3:
-                    return        ## ?
-                channel, pitch, velocity = message
-                channel -= NOTE_ON
-                if channel < len(self.threads):
-                    thread = self.threads[channel]
-                    thread.note(pitch, velocity)
-        self.midi.set_callback(receive_message)
+        self.midi.set_callback(self._receive)
         while True:
             time.sleep(0.1)
 
-    def perform_callbacks(self):
-        while True:
-            try:
-                control, value = self.queue.get_nowait()
-            except queue.Empty:
+    def _receive(self, event, data=None):
+        """rtmidi callback, on its own thread"""
+        message, deltatime = event
+        if message[0] == TIMING_CLOCK:
+            if self.clock is not None:
+                self.clock.pulse()
+        elif message[0] == START:
+            if self.clock is not None:
+                self.clock.start()
+        elif message[0] == CONTINUE:
+            if self.clock is not None:
+                self.clock.resume()
+        elif message[0] == STOP:
+            if self.clock is not None:
+                self.clock.stop()
+        elif message[0] & 0b11110000 in (CONTROLLER_CHANGE, NOTE_ON, NOTE_OFF):
+            if len(message) < 3:
                 return
-            if control in self.callbacks:
-                if num_args(self.callbacks[control]) > 0:
-                    self.callbacks[control](value)
-                else:
-                    self.callbacks[control]()
-                
+            self.events.push(time.perf_counter(), message[0], message[1], message[2])
+
+    def perform_callbacks(self):
+        """Handle the input that arrived since the last tick, in the order it arrived; called by the driver each tick"""
+        events = self.events
+        while events.head != events.tail:
+            t, status, data1, data2 = events.pop()
+            kind = status & 0b11110000
+            if kind == CONTROLLER_CHANGE:
+                if data1 in self.callbacks:
+                    if num_args(self.callbacks[data1]) > 0:
+                        self.callbacks[data1](data2 / 127.0)
+                    else:
+                        self.callbacks[data1]()
+            else:
+                channel = status & 0b00001111
+                if channel < len(self.threads):
+                    self.threads[channel].note(data1, data2 / 127.0 if kind == NOTE_ON else 0)
+
+    def follow(self, clock):
+        """Feed incoming MIDI clock, start, stop and continue to the given MidiClock (or None to stop)"""
+        self.open()
+        self.clock = clock
+        self.midi.ignore_types(timing=clock is None)
 
     def callback(self, control, f):
         """For a given control message, call a function"""
+        self.open()
         self.callbacks[control] = f                
 
 
-midi_out = MidiOut(int(sys.argv[1]) if len(sys.argv) > 1 else 0)
-midi_in = MidiIn(int(sys.argv[2]) if len(sys.argv) > 2 else 0)
-time.sleep(0.5)
-print("MIDI ready")
\ No newline at end of file
+class MidiRouter(object):
+    """Sends MIDI for each channel through one of several MidiOut ports, each with its own queue and sender thread,
+       so a slow interface only holds up its own instruments
+       Threads use their own port if they have one set, otherwise the port routed for their channel, otherwise the default
+    """
+
+    def __init__(self, default):
+        self.default = default
+        self.ports = [default]
+        self.channels = {}      # channel -> MidiOut
+        self._timestamp = None
+        self._capture = None
+
+    def open(self, interface, throttle=0):
+        """Open another MidiOut port and add it to the router, or return the router's port already on that interface"""
+        for port in self.ports:
+            if (port.interface if port.interface is not None else interface_arg(1)) == interface:
+                if throttle:
+                    port.throttle = throttle
+                return port
+        return self.add(MidiOut(interface, throttle))
+
+    def add(self, port):
+        if port not in self.ports:
+            port.timestamp, port.capture = self._timestamp, self._capture
+            self.ports.append(port)
+        return port
+
+    def route(self, port, channels):
+        """Send the given channel (or channels, eg range(9, 17)) through port, which can be a MidiOut or an interface index"""
+        if type(port) == int:
+            port = self.open(port)
+        self.add(port)
+        if type(channels) == int:
+            channels = [channels]
+        for channel in channels:
+            self.channels[channel] = port
+        return port
+
+    def port(self, channel):
+        return self.channels.get(channel, self.default)
+
+    @property
+    def timestamp(self):
+        return self._timestamp
+
+    @timestamp.setter
+    def timestamp(self, timestamp):
+        self._timestamp = timestamp
+        for port in self.ports:
+            port.timestamp = timestamp
+
+    @property
+    def capture(self):
+        return self._capture
+
+    @capture.setter
+    def capture(self, capture):
+        self._capture = capture
+        for port in self.ports:
+            port.capture = capture
+
+    def send_control(self, channel, control, value, automation=False):
+        self.port(channel).send_control(channel, control, value, automation)
+
+    def send_note(self, channel, pitch, velocity):
+        self.port(channel).send_note(channel, pitch, velocity)
+
+    def flush(self):
+        for port in self.ports:
+            port.flush()
+
+    def pending(self):
+        return sum(port.pending() for port in self.ports)
+
+    def stats(self):
+        """Print throughput and timing for each port"""
+        for port in self.ports:
+            stats = port.stats()
+            print("[MIDI OUT %s: %d sent (%.1f/s), %d superseded, %d elided, %d pending, late %.2fms mean %.2fms max]" % (
+                stats['interface'], stats['sent'], stats['rate'], stats['superseded'], stats['elided'], stats['pending'],
+                stats['mean_late'] * 1000, stats['max_late'] * 1000))
+
+
+midi_out = MidiOut(None, lazy=True)     # interfaces come from the command line when the ports first open
+router = MidiRouter(midi_out)
+midi_in = MidiIn(None, lazy=True)
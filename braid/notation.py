@@ -9,22 +9,76 @@ class Scale(list):
     """Set constrain=True to octave shift out-of-range degrees into range, preserving pitch class, else ScaleError"""
     """Any number of scale steps is supported, but default for MAJ: """
     """ -1, -2, -3, -4, -5, -6, -7, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14"""
+    """Degrees in range and quantized intervals from -128 to 255 are looked up in tables built with the scale"""
 
     def __init__(self, *args, constrain=False, octaves_above=2):
-        self.constrain = constrain
-        self.octaves_above = octaves_above
+        self._constrain = constrain
+        self._octaves_above = octaves_above
         super(Scale, self).__init__(*args)
+        self._build()
+
+    def _build(self):
+        """Tabulate the semitone of each degree in range and the quantized value of each interval"""
+        self._degrees = {}
+        self._quantized = {}
+        if not len(self):
+            return
+        for degree in range(-len(self), self._upper_bound() + 1):
+            if degree != 0:
+                self._degrees[degree] = self._degree(degree)
+        semitones = set(self)
+        nearest = []    # quantized value of each interval within the octave, when not in the scale
+        for interval in range(12):
+            try:
+                nearest.append(self._degree(bisect_left(list(self), interval) + 1))
+            except ScaleError:
+                nearest.append(None)
+        for interval in range(-128, 256):
+            if interval in semitones:
+                self._quantized[interval] = interval
+            elif nearest[interval % 12] is not None:
+                self._quantized[interval] = nearest[interval % 12] + (interval // 12) * 12
+
+    @property
+    def constrain(self):
+        return self._constrain
+
+    @constrain.setter
+    def constrain(self, constrain):
+        self._constrain = constrain
+        self._build()
+
+    @property
+    def octaves_above(self):
+        return self._octaves_above
+
+    @octaves_above.setter
+    def octaves_above(self, octaves_above):
+        self._octaves_above = octaves_above
+        self._build()
 
     def __getitem__(self, degree):
+        if type(degree) == int:
+            try:
+                return self._degrees[degree]
+            except KeyError:
+                pass
         grace = False
         if type(degree) == float:
             degree = int(degree)
             grace = True
         if not ((type(degree) == int or degree == R) and degree != 0):
             raise ScaleError(degree)
-        octave_shift = 0
         if degree == R:
             degree = list.__getitem__(self, randint(0, len(self) - 1))
+        semitone = self._degree(degree)
+        if grace:
+            return float(semitone)
+        return semitone
+
+    def _degree(self, degree):
+        """Work out the semitone of a degree, without the table"""
+        octave_shift = 0
         if self.constrain:
             while degree > self._upper_bound():
                 degree = degree - len(self)
@@ -41,8 +95,6 @@ class Scale(list):
         degree = ((degree - 1) % len(self)) + 1
         semitone = super(Scale, self).__getitem__(degree - 1)
         semitone += octave_shift
-        if grace:
-            return float(semitone)
         return semitone
 
     def _upper_bound(self):
@@ -59,6 +111,11 @@ class Scale(list):
         """Quantize a semitone interval to the scale, negative and positive intervals are accepted without bounds"""
         """Intervals not in the scale are shifted up in pitch to the nearest interval in the scale"""
         """i.e. for MAJ, 1 returns 2,  3 returns 4, -2 returns -1, -4 returns -3, etc..."""
+        if type(interval) == int:
+            try:
+                return self._quantized[interval]
+            except KeyError:
+                pass
         if interval in self:
             return interval
         octave_shift = (interval // 12) * 12
@@ -66,6 +123,59 @@ class Scale(list):
         degree = bisect_left(list(self), interval) + 1
         return self[degree] + octave_shift
 
+    # direct list mutations rebuild the tables
+
+    def __setitem__(self, index, value):
+        list.__setitem__(self, index, value)
+        self._build()
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self._build()
+
+    def __iadd__(self, other):
+        list.__iadd__(self, other)
+        self._build()
+        return self
+
+    def __imul__(self, n):
+        list.__imul__(self, n)
+        self._build()
+        return self
+
+    def append(self, semitone):
+        list.append(self, semitone)
+        self._build()
+
+    def extend(self, semitones):
+        list.extend(self, semitones)
+        self._build()
+
+    def insert(self, index, semitone):
+        list.insert(self, index, semitone)
+        self._build()
+
+    def pop(self, index=-1):
+        semitone = list.pop(self, index)
+        self._build()
+        return semitone
+
+    def remove(self, semitone):
+        list.remove(self, semitone)
+        self._build()
+
+    def reverse(self):
+        list.reverse(self)
+        self._build()
+
+    def sort(self, *args, **kwargs):
+        list.sort(self, *args, **kwargs)
+        self._build()
+
+    def clear(self):
+        list.clear(self)
+        self._build()
+
 
 class ScaleError(Exception):
 
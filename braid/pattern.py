@@ -1,4 +1,4 @@
-import collections
+import collections, bisect
 from random import choice, random
 from . import num_args
 from .signal import ease_in, ease_out
@@ -12,6 +12,49 @@ class Q(collections.deque):
         self.drunk = drunk
         super(Q, self).__init__(iterable)
 
+class Steps(list):
+    """The steps of a resolved pattern, with where each one starts in the cycle
+       Nested subdivisions only keep their actual steps, each with its position out of the pattern's lcm divisions,
+       so size and resolve time follow the number of steps rather than the lcm
+    """
+
+    def __init__(self, values=(), positions=None, divisions=None):
+        list.__init__(self, values)
+        self.positions = positions      # subdivision index of each step, or None if they're evenly spaced
+        self.divisions = len(self) if divisions is None else divisions
+
+    def at(self, phase):
+        """Index of the step playing at the given phase of the cycle"""
+        if self.positions is None:
+            return int(phase * len(self))
+        return bisect.bisect_right(self.positions, int(phase * self.divisions)) - 1
+
+    def start(self, index):
+        """Phase at which the given step starts"""
+        return (index if self.positions is None else self.positions[index]) / self.divisions
+
+    def end(self, index):
+        """Phase at which the given step gives way to the next (1.0 for the last)"""
+        if index + 1 >= len(self):
+            return 1.0
+        return self.start(index + 1)
+
+    def span(self, index):
+        """Subdivisions [from, to) that the given step covers"""
+        if self.positions is None:
+            return index, index + 1
+        return self.positions[index], self.positions[index + 1] if index + 1 < len(self) else self.divisions
+
+    def dense(self):
+        """All lcm divisions as a flat list, with 0 for those that continue the previous step"""
+        if self.positions is None:
+            return list(self)
+        steps = [0] * self.divisions
+        for position, step in zip(self.positions, self):
+            steps[position] = step
+        return steps
+
+
 class Pattern(list):
 
     """ Pattern is just a list (of whatever) that can be specified in compacted form
@@ -22,47 +65,87 @@ class Pattern(list):
 
     def __init__(self, value=[0], drunk=False):
         self.drunk = drunk
+        self._table = None      # compiled step table, False if the subdivision itself is stochastic
+        self._slots = []        # (index, node) of the steps that must be re-sampled on each resolve
         list.__init__(self, value)
 
     def resolve(self):
-        """Choose a path through the Markov chain"""
-        return self._unroll(self._subresolve(self))
+        """Choose a path through the Markov chain, returning its Steps"""
+        if self._table is None:
+            self._compile()
+        if self._table is False:
+            return self._unroll(self._subresolve(self))
+        if not self._slots:
+            return self._table
+        steps = Steps(self._table, self._table.positions, self._table.divisions)
+        for index, node in self._slots:
+            steps[index] = self._choose(node)
+        return steps
+
+    def _compile(self):
+        """Unroll the pattern once, leaving tuples and Qs in place to be sampled by resolve"""
+        if not self._fixed(self):
+            self._table = False
+            self._slots = []
+            return
+        self._table = self._unroll(self)
+        self._slots = [(i, step) for i, step in enumerate(self._table) if type(step) == tuple or type(step) == Q]
+
+    def _fixed(self, pattern):
+        """Check that no tuple or Q in a subbranch can choose a list, which would change the subdivision"""
+        for step in pattern:
+            if type(step) == list:
+                if not self._fixed(step):
+                    return False
+            elif type(step) == tuple or type(step) == Q:
+                for option in step:
+                    if type(option) == list or ((type(option) == tuple or type(option) == Q) and not self._fixed([option])):
+                        return False
+        return True
+
+    def _invalidate(self):
+        self._table = None
+        self._slots = []
 
     def _subresolve(self, pattern):
         """Resolve a subbranch of the pattern"""
         steps = []
         for step in pattern:
-            while type(step) == tuple or type(step) == Q:
-                if type(step) == tuple:
-                    step = choice(step)
-                else:
-                    coin = choice([0, 1])
-                    if coin and (self.drunk or step.drunk):
-                        step.rotate(1)
-                    else:
-                        step.rotate(-1)
-                    step = step[-1]
-
+            step = self._choose(step)
             if type(step) == list:
                 step = self._subresolve(step)
             steps.append(step)
         return steps
 
-    def _unroll(self, pattern, divs=None, r=None):
-        """Unroll a compacted form to a pattern with lcm steps"""
-        if divs is None:
-            divs = self._get_divs(pattern)
-            r = []
-        elif r is None:
-            r = []
-        for step in pattern:
-            if type(step) == list:
-                self._unroll(step, (divs // len(pattern)), r)
+    def _choose(self, step):
+        """Sample a tuple or Q (recursively) down to a single step"""
+        while type(step) == tuple or type(step) == Q:
+            if type(step) == tuple:
+                step = choice(step)
             else:
-                r.append(step)
-                for i in range((divs // len(pattern)) - 1):
-                    r.append(0)
-        return r
+                coin = choice([0, 1])
+                if coin and (self.drunk or step.drunk):
+                    step.rotate(1)
+                else:
+                    step.rotate(-1)
+                step = step[-1]
+        return step
+
+    def _unroll(self, pattern):
+        """Unroll a compacted form to its steps, positioned out of lcm divisions"""
+        divisions = self._get_divs(pattern)
+        steps, positions = [], []
+        def place(pattern, start, span):
+            span //= len(pattern)
+            for step in pattern:
+                if type(step) == list:
+                    place(step, start, span)
+                else:
+                    steps.append(step)
+                    positions.append(start)
+                start += span
+        place(pattern, 0, divisions)
+        return Steps(steps, positions if len(steps) != divisions else None, divisions)
 
     def _get_divs(self, pattern):
         """Find lcm for a subpattern"""
@@ -81,24 +164,29 @@ class Pattern(list):
 
     def replace(self, value, target):
         list.__init__(self, [target if step == value else value for step in self])
+        self._invalidate()
 
     def rotate(self, steps=1):
         # steps > 0 = right rotation, steps < 0 = left rotation
         if steps:
             steps = -(steps % len(self))
             list.__init__(self, self[steps:] + self[:steps])
+            self._invalidate()
 
     def blend(self, pattern_2, balance=0.5):
         l = blend(self, pattern_2, balance)
         list.__init__(self, l)
+        self._invalidate()
 
     def add(self, pattern_2):
         l = add(self, pattern_2)
         list.__init__(self, l)
+        self._invalidate()
 
     def xor(self, pattern_2):
         l = xor(self, pattern_2)
         list.__init__(self, l)
+        self._invalidate()
 
     def invert(self, off_note=0, note_list=None):
         """replace all occurrences of off_note with consecutive values from note_list (default = self.notes())"""
@@ -115,6 +203,57 @@ class Pattern(list):
             else:
                 inverted_pattern.append(off_note)
         list.__init__(self, inverted_pattern)
+        self._invalidate()
+
+    # direct list mutations also invalidate the compiled table (nested sublists are not tracked, see the docs)
+
+    def __setitem__(self, index, value):
+        list.__setitem__(self, index, value)
+        self._invalidate()
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self._invalidate()
+
+    def __iadd__(self, other):
+        self._invalidate()
+        return list.__iadd__(self, other)
+
+    def __imul__(self, n):
+        self._invalidate()
+        return list.__imul__(self, n)
+
+    def append(self, step):
+        list.append(self, step)
+        self._invalidate()
+
+    def extend(self, steps):
+        list.extend(self, steps)
+        self._invalidate()
+
+    def insert(self, index, step):
+        list.insert(self, index, step)
+        self._invalidate()
+
+    def pop(self, index=-1):
+        self._invalidate()
+        return list.pop(self, index)
+
+    def remove(self, step):
+        list.remove(self, step)
+        self._invalidate()
+
+    def reverse(self):
+        list.reverse(self)
+        self._invalidate()
+
+    def sort(self, *args, **kwargs):
+        list.sort(self, *args, **kwargs)
+        self._invalidate()
+
+    def clear(self):
+        list.clear(self)
+        self._invalidate()
 
 
 def prep(pattern_1, pattern_2):
@@ -122,8 +261,8 @@ def prep(pattern_1, pattern_2):
         pattern_1 = Pattern(pattern_1)
     if type(pattern_2) is not Pattern:
         pattern_2 = Pattern(pattern_2)
-    p1_steps = pattern_1.resolve()
-    p2_steps = pattern_2.resolve()
+    p1_steps = pattern_1.resolve().dense()
+    p2_steps = pattern_2.resolve().dense()
     pattern = [None] * lcm(len(p1_steps), len(p2_steps))
     p1_div = len(pattern) / len(p1_steps)
     p2_div = len(pattern) / len(p2_steps)
@@ -133,19 +272,30 @@ def prep(pattern_1, pattern_2):
 def blend(pattern_1, pattern_2, balance=0.5):
     """Probabalistically blend two Patterns"""
     pattern, p1_steps, p2_steps, p1_div, p2_div = prep(pattern_1, pattern_2)
-    for i, cell in enumerate(pattern):
-        if i % p1_div == 0 and i % p2_div == 0:
+    return Pattern(blend_steps(p1_steps, p2_steps, balance))
+
+
+def blend_steps(p1_steps, p2_steps, balance=0.5):
+    """Probabalistically blend two resolved, flat lists of steps"""
+    pattern = [None] * lcm(len(p1_steps), len(p2_steps))
+    p1_div = len(pattern) // len(p1_steps)
+    p2_div = len(pattern) // len(p2_steps)
+    p1_keep = ease_out()(balance)    # avoid empty middle from linear blend
+    p2_keep = ease_in()(balance)
+    for i in range(len(pattern)):
+        on_1 = i % p1_div == 0
+        on_2 = i % p2_div == 0
+        if on_1 and on_2:
             if random() > balance:
-                pattern[i] = p1_steps[int(i / p1_div)]
+                pattern[i] = p1_steps[i // p1_div]
             else:
-                pattern[i] = p2_steps[int(i / p2_div)]
-        elif i % p1_div == 0:
-            if random() > ease_out()(balance):     # avoid empty middle from linear blend
-                pattern[i] = p1_steps[int(i / p1_div)]
-        elif i % p2_div == 0:
-            if random() <= ease_in()(balance):
-                pattern[i] = p2_steps[int(i / p2_div)]
-    pattern = Pattern(pattern)
+                pattern[i] = p2_steps[i // p2_div]
+        elif on_1:
+            if random() > p1_keep:
+                pattern[i] = p1_steps[i // p1_div]
+        elif on_2:
+            if random() <= p2_keep:
+                pattern[i] = p2_steps[i // p2_div]
     return pattern
 
 
@@ -0,0 +1,118 @@
+import time, weakref
+
+
+class Histogram(object):
+    """Counts of durations in power-of-two buckets of microseconds, with their total and maximum"""
+
+    buckets = 24        # the last one collects everything from ~8s up
+
+    def __init__(self):
+        self.counts = [0] * self.buckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        bucket = min(max(int(seconds * 1e6), 0).bit_length(), self.buckets - 1)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        """Upper bound, in seconds, of the bucket holding the given share (0-1) of the durations"""
+        if not self.count:
+            return 0.0
+        remaining = p * self.count
+        for bucket, count in enumerate(self.counts):
+            remaining -= count
+            if remaining <= 0:
+                break
+        return min((1 << bucket) / 1e6, self.max)
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.mean(),
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+
+class Profiler(object):
+    """Where the driver's time goes: each thread's updates, and the sections of an update that run user code
+       (pattern resolves, control updates, callable steps, triggers), plus tick overruns, MIDI queue depth and send latency
+       Off by default, when the hooks cost one attribute check each
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.every = None           # seconds between printed reports while enabled, or None
+        self.reset()
+
+    def reset(self):
+        self.sections = {}
+        self.threads = weakref.WeakKeyDictionary()  # thread -> Histogram of its updates, forgotten when the thread is
+        self.latency = Histogram()                  # how late MIDI messages went out after their timestamp
+        self.ticks = 0
+        self.overruns = 0                           # ticks that took longer than the grain
+        self.depth_total = 0
+        self.depth_max = 0
+        self._report_t = time.perf_counter()
+
+    def record(self, section, seconds):
+        if section not in self.sections:
+            self.sections[section] = Histogram()
+        self.sections[section].add(seconds)
+
+    def record_thread(self, thread, seconds):
+        if thread not in self.threads:
+            self.threads[thread] = Histogram()
+        self.threads[thread].add(seconds)
+
+    def record_tick(self, seconds, grain, depth):
+        self.record('tick', seconds)
+        self.ticks += 1
+        if seconds > grain:
+            self.overruns += 1
+        self.depth_total += depth
+        self.depth_max = max(self.depth_max, depth)
+        if self.every is not None and time.perf_counter() - self._report_t >= self.every:
+            self.report()
+            self.reset()
+
+    def stats(self):
+        """Everything recorded since the last reset, as a dict (times in seconds)"""
+        return {
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'mean_depth': self.depth_total / self.ticks if self.ticks else 0.0,
+            'max_depth': self.depth_max,
+            'latency': self.latency.stats(),
+            'sections': {section: histogram.stats() for section, histogram in self.sections.items()},
+            'threads': {label(thread): histogram.stats() for thread, histogram in list(self.threads.items())},
+        }
+
+    def report(self):
+        """Print the stats, slowest threads first"""
+        stats = self.stats()
+        print("[Profile: %d ticks, %d overruns, MIDI queue %.1f mean %d max, MIDI late %.2fms mean %.2fms max]" % (
+            stats['ticks'], stats['overruns'], stats['mean_depth'], stats['max_depth'],
+            stats['latency']['mean'] * 1000, stats['latency']['max'] * 1000))
+        for kind in ('sections', 'threads'):
+            for name, s in sorted(stats[kind].items(), key=lambda item: -item[1]['total']):
+                print("[  %-24s %8d calls, %8.1fus mean, p99 < %8.1fus, %8.1fus max, %8.1fms total]" % (
+                    name, s['count'], s['mean'] * 1e6, s['p99'] * 1e6, s['max'] * 1e6, s['total'] * 1000))
+
+
+def label(thread):
+    return "%s %d (%x)" % (type(thread).__name__, thread._channel, id(thread) & 0xffff)
+
+
+profiler = Profiler()
@@ -1,5 +1,9 @@
-import time, math, __main__
+import time, math, bisect, __main__
 from random import random, triangular, uniform
+try:
+    import numpy
+except ImportError as e:
+    numpy = None
 
 
 def calc_pos(pos, rate, phase):
@@ -167,7 +171,7 @@ def timeseries(timeseries):
     return f
 
 
-def breakpoints(*breakpoints):
+def breakpoints(*breakpoints, cursor=False):
     """ eg:
         breakpoints(    [0, 0],
                         [2, 1, linear()], 
@@ -177,6 +181,9 @@ def breakpoints(*breakpoints):
                         [14, 2, ease_out()], 
                         [15, 0, ease_in_out()]
                         )
+
+        Segments are found by binary search. With cursor=True, the last segment is remembered and stepped forward from,
+        which is constant time for positions that mostly increase (eg, a tween playing through a long envelope)
     """
     min_x = min(breakpoints, key=lambda bp: bp[0])[0]
     domain = max(breakpoints, key=lambda bp: bp[0])[0] - min_x
@@ -185,22 +192,35 @@ def breakpoints(*breakpoints):
     breakpoints = [
         [(bp[0] - min_x) / float(domain), (bp[1] - min_y) / float(resolution), None if not len(bp) == 3 else bp[2]] for
         bp in breakpoints]
+    xs = [bp[0] for bp in breakpoints]
+    segments = [None]     # (start x, start y, 1 / width, height, shape) of the segment ending at each breakpoint
+    for start_point, end_point in zip(breakpoints, breakpoints[1:]):
+        width = end_point[0] - start_point[0]
+        segments.append((start_point[0], start_point[1], 1.0 / width if width else 0.0, end_point[1] - start_point[1], end_point[2]))
+    last = [0]
 
     def f(pos):
-        index = 0
-        while index < len(breakpoints) and breakpoints[index][0] < pos:
-            index += 1
+        if cursor:
+            index = last[0]
+            if index > 0 and pos <= xs[index - 1]:
+                index = bisect.bisect_left(xs, pos)
+            else:
+                while index < len(xs) and xs[index] < pos:
+                    index += 1
+            last[0] = index
+        else:
+            index = bisect.bisect_left(xs, pos)
         if index == 0:
             return breakpoints[index][1]
         if index == len(breakpoints):
             return breakpoints[-1][1]
-        start_point, end_point = breakpoints[index - 1], breakpoints[index]
-        if end_point[2] is None:
-            return start_point[1]
-        pos = (pos - start_point[0]) / (end_point[0] - start_point[0])
-        if end_point[2] is not linear:
-            pos = end_point[2](pos)
-        return start_point[1] + (pos * (end_point[1] - start_point[1]))
+        x, y, scale, height, shape = segments[index]
+        if shape is None:
+            return y
+        pos = (pos - x) * scale
+        if shape is not linear:
+            pos = shape(pos)
+        return y + (pos * height)
 
     return f
 
@@ -214,6 +234,48 @@ def cross(division, degree):
     return f
 
 
+class Wavetable():
+    """A signal precomputed into a table of evenly spaced samples, read back with linear interpolation
+       Much cheaper to call than a composed signal, at the cost of smoothing anything sharper than a table step
+       Don't use it for noise, which would then repeat the same values every cycle
+    """
+
+    def __init__(self, signal, size=1024):
+        self.signal = signal
+        self.size = size
+        self.table = [signal(i / size) for i in range(size + 1)]
+        self.array = numpy.array(self.table) if numpy is not None else None
+
+    def __call__(self, pos):
+        if pos <= 0.0:
+            return self.table[0]
+        index = pos * self.size
+        i = int(index)
+        if i >= self.size:
+            return self.table[-1]
+        a = self.table[i]
+        return a + (self.table[i + 1] - a) * (index - i)
+
+    def batch(self, positions):
+        """Evaluate over a sequence of positions in one call"""
+        if self.array is None:
+            return [self(pos) for pos in positions]
+        return numpy.interp(numpy.clip(positions, 0.0, 1.0), numpy.linspace(0.0, 1.0, self.size + 1), self.array)
+
+
+def wavetable(signal, size=1024):
+    """Compile a signal into a Wavetable"""
+    return Wavetable(signal, size)
+
+
+def evaluate(signal, positions):
+    """Evaluate a signal over a sequence of positions in one call, as a numpy array if numpy is available"""
+    if hasattr(signal, 'batch'):
+        return signal.batch(positions)
+    values = [signal(pos) for pos in positions]
+    return numpy.array(values) if numpy is not None else values
+
+
 class Plotter():
     instance = None
 
@@ -231,9 +293,10 @@ class Plotter():
     def plot(cls, bp_f, color="red"):
         if not hasattr(__main__, "__file__") or cls.instance is None:
             cls.instance = Plotter()
+        width = int(cls.instance.width)
+        values = evaluate(bp_f, [float(i) / cls.instance.width for i in range(width)])
         points = [(i + cls.instance.margin,
-                   ((1.0 - bp_f(float(i) / cls.instance.width)) * cls.instance.height) + cls.instance.margin) for i in
-                  range(int(cls.instance.width))]
+                   ((1.0 - values[i]) * cls.instance.height) + cls.instance.margin) for i in range(width)]
         cls.instance.w.create_line(points, fill=color, width=2.0)
 
     @classmethod
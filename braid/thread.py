@@ -1,6 +1,9 @@
-import collections, yaml, os, math
-from .core import driver, LIVECODING
-from . import num_args, midi_out
+import os, math, time
+from .core import driver, play, Triggers, LIVECODING, EDGE_MARGIN
+from . import num_args
+from .midi import router
+from .profiling import profiler
+from .pattern import Steps
 from .signal import linear
 from .notation import *
 from .tween import *
@@ -10,6 +13,10 @@ class Thread(object):
     """Class definitions"""
 
     threads = driver.threads
+    timing_attrs = ('phase', 'micro')  # attributes that move step edges when changed, rescheduling the thread
+    _shaping = frozenset(('_rate', '_sync', '_Thread__phase_correction', '_channel', '_port'))   # assigning these recompiles, along with every add_attr
+    _fast_update = None     # update and pitch functions specialized to the current configuration, see _compile
+    _fast_pitch = None
 
     @classmethod
     def add_attr(cls, name, default=0):
@@ -22,15 +29,18 @@ class Thread(object):
 
         def setter(self, value):
             if isinstance(value, Tween):
-                value.start(self, getattr(self, name))
+                value.start(self, getattr(self, name), "_%s" % name)
             if value is True:
                 value = 127
             if value is False:
                 value = 0
             setattr(self, "_%s" % name, value)
+            if name in Thread.timing_attrs or (self.controls is not None and name in self.controls):
+                driver.reschedule(self)
 
         setattr(cls, "_%s" % name, default)
         setattr(cls, name, property(getter, setter))
+        cls._shaping = cls._shaping | {"_%s" % name}
 
     @classmethod
     def setup(cls):
@@ -54,6 +64,8 @@ class Thread(object):
             object.__setattr__(self, key, value)
         except Exception as e:
             print("[Error: \"%s\"]" % e)
+        if key in self._shaping:
+            self.__dict__['_fast_update'] = self.__dict__['_fast_pitch'] = None
 
     def __getattr__(self, key):
         print("[No property %s]" % key)
@@ -70,18 +82,24 @@ class Thread(object):
         # private reference variables
         self._attr_frozen = False
         self._channel = channel
+        self._port = None
         self._running = False
         self._cycles = 0.0
+        self._driver_cycles = driver._cycles
+        self._tick_rate = 1.0
+        self._t = driver.t
+        self._edge = None
         self._base_phase = 0.0
         self._last_edge = 0
         self._index = -1
         self._transpose_index = -1
-        self._steps = [0]
+        self._steps = Steps([0])
         self._previous_pitch = 60
         self._previous_step = 1
         self.__phase_correction = 0.0
         self._control_values = {}
-        self._triggers = []
+        self._triggers = Triggers()
+        self._cycle_edges = 0           # how many times the pattern has come back to the top, for triggers
         self._sync = sync
         self._start_lock = False
 
@@ -89,7 +107,7 @@ class Thread(object):
         self.pattern = [0]
         self.rate = 1.0
         self.keyboard = False
-        self.micro = linear()
+        self.micro = None
 
         print("[Created thread on channel %d]" % self._channel)
         self._attr_frozen = True
@@ -99,10 +117,19 @@ class Thread(object):
 
     def update(self, delta_t):
         """Run each tick and update the state of the Thread"""
+        update = self._fast_update
+        if update is None:
+            update = self._compile()
+        update(delta_t)
+
+    def _update(self, delta_t):
+        """The general update, for when timing is tweened"""
         if not self._running:
             return
-        self.update_controls()
-        self._cycles += delta_t * self.rate * driver.rate
+        self._update_controls()
+        self._cycles = self._current_cycles()
+        self._driver_cycles = driver._cycles
+        self._tick_rate = self.rate
         if self._sync and isinstance(self._rate, Tween):
             pc = self._rate.get_phase()
             if pc is not None:
@@ -110,28 +137,179 @@ class Thread(object):
         self._base_phase = (self._cycles + self.phase + self._phase_correction) % 1.0
         if self.micro is not None:
             self._base_phase = self.micro(self._base_phase)
-        i = int(self._base_phase * len(self._steps))
+        i = self._steps.at(self._base_phase)
         if i != self._index or (
                 len(self._steps) == 1 and int(self._cycles) != self._last_edge):  # contingency for whole notes
-            if self._start_lock:
-                self._index = self._transpose_index = i
+            self._step(i, delta_t)
+        if self._triggers.heap and self._triggers.heap[0][0] <= self._cycle_edges + self._base_phase:
+            self.update_triggers()  # one at a fraction of a cycle
+        self._last_edge = int(self._cycles)
+
+    def _compile(self):
+        """Specialize update and pitch resolution to the thread's configuration, leaving its checks out of every tick
+           Assigning any attribute in _shaping throws these away, so they're rebuilt on the next update
+        """
+        d = self.__dict__
+        rate, phase, correction, micro = self._rate, self._phase, self.__phase_correction, self._micro
+        controls = self.controls
+        tweened_controls = controls is not None and any(isinstance(getattr(self, "_%s" % control), Tween) for control in controls)
+        if any(isinstance(value, Tween) for value in (rate, phase, correction, micro)):
+            update = self._update
+        else:
+            triggers = self._triggers
+            pending_controls = [controls is not None]    # untweened controls only change when assigned, which recompiles
+
+            def update(delta_t):
+                if not d['_running']:
+                    return
+                if pending_controls[0]:
+                    self._update_controls()
+                    pending_controls[0] = tweened_controls
+                cycles = d['_cycles'] + (driver._cycles - d['_driver_cycles']) * d['_tick_rate']
+                d['_cycles'] = cycles
+                d['_driver_cycles'] = driver._cycles
+                d['_tick_rate'] = rate
+                base = (cycles + phase + correction) % 1.0
+                if micro is not None:
+                    base = micro(base)
+                d['_base_phase'] = base
+                steps = d['_steps']
+                i = steps.at(base)
+                if i != d['_index'] or (len(steps) == 1 and int(cycles) != d['_last_edge']):
+                    self._step(i, delta_t)
+                if triggers.heap and triggers.heap[0][0] <= d['_cycle_edges'] + base:
+                    self.update_triggers()
+                d['_last_edge'] = int(cycles)
+
+        transpose, chord = self._transpose, self._chord
+        if isinstance(transpose, Tween) or isinstance(chord, Tween) or type(transpose) not in (int, float):
+            pitch = self._pitch
+        elif chord is None:
+            offset = int(transpose)
+
+            def pitch(step):
+                return step + offset
+        else:
+            root, scale = chord
+            root += int(transpose)
+
+            def pitch(step):
+                return scale.quantize(root + scale[step])
+
+        d['_fast_update'], d['_fast_pitch'] = update, pitch
+        return update
+
+    def _update_controls(self):
+        if profiler.enabled:
+            c = time.perf_counter()
+            self.update_controls()
+            profiler.record('update_controls', time.perf_counter() - c)
+        else:
+            self.update_controls()
+
+    def _step(self, i, delta_t):
+        """Move on to the next step, and play it"""
+        if driver.stamping:
+            driver.stamp(self._edge_time(i, delta_t))
+        if self._start_lock:
+            self._index = i
+            self._transpose_index = self._steps.span(i)[0]
+        else:
+            previous = self._index
+            self._index = (self._index + 1) % len(self._steps)  # dont skip steps
+            if type(self.transpose) == list:
+                moves = self._transpose_moves(previous, self._index)
+                self._transpose_index = (self._transpose_index + moves) % len(self.transpose)
+        if self._index == 0:
+            self._cycle_edges += 1
+            self.update_triggers()
+            if isinstance(self.pattern, Tween):  # pattern tweens only happen on an edge
+                pattern = self.pattern.value()
+            else:
+                pattern = self.pattern
+            if profiler.enabled:
+                c = time.perf_counter()
+                self._steps = pattern.resolve()
+                profiler.record('resolve', time.perf_counter() - c)
             else:
-                self._index = (self._index + 1) % len(self._steps)  # dont skip steps
-                if type(self.transpose) == list and not self._index % int(self.transpose_step_len):
-                    self._transpose_index = (self._transpose_index + 1) % len(self.transpose)
-            if self._index == 0:
-                self.update_triggers()
-                if isinstance(self.pattern, Tween):  # pattern tweens only happen on an edge
-                    pattern = self.pattern.value()
-                else:
-                    pattern = self.pattern
                 self._steps = pattern.resolve()  # new patterns kick in here
-            if self._start_lock:
-                self._start_lock = False
+        if self._start_lock:
+            self._start_lock = False
+        else:
+            step = self._steps[self._index]
+            self.play(step)
+        if driver.stamping:
+            driver.stamp()
+
+    def _transpose_moves(self, previous, index):
+        """How many times a transpose list moves on from one step to the next: once for each lcm division
+           that is a multiple of transpose_step_len, counting the divisions between the steps as well
+        """
+        length = int(self.transpose_step_len)
+        start = self._steps.span(previous)[0] if previous >= 0 else -1
+        if index > previous:
+            return self._steps.span(index)[0] // length - start // length
+        return (self._steps.divisions - 1) // length - start // length + 1    # wrapped around to the first step
+
+    def _edge_time(self, i, delta_t):
+        """Interpolate the driver time at which the step edge crossed during the last tick"""
+        speed = self.rate * driver.rate
+        if speed <= 0:
+            return driver.t
+        if len(self._steps) == 1:
+            overshoot = self._cycles % 1.0
+        elif i == (self._index + 1) % len(self._steps):
+            overshoot = self._base_phase - self._steps.start(i)
+        else:  # catching up on a late step, play it now
+            return driver.t
+        return driver.t - min(max(overshoot / speed, 0.0), delta_t)
+
+    def _current_cycles(self):
+        """Cycles as of the driver's last tick, integrating at the rate seen on this thread's previous update"""
+        return self._cycles + (driver._cycles - self._driver_cycles) * self._tick_rate
+
+    def next_edge(self):
+        """Driver time of this thread's next step edge at the current rate, or None if not running"""
+        if not self._running:
+            return None
+        if self._continuous():  # on the grain boundary, so continuous threads share ticks
+            return (round(driver.t / driver.grain) + 1) * driver.grain
+        speed = self.rate * driver.rate
+        if speed <= 0:
+            return None
+        steps = self._steps
+        if len(steps) == 1:  # whole notes change on the cycle edge
+            return driver.t + (math.floor(self._cycles) + 1 - self._cycles) / speed + EDGE_MARGIN
+        phase = (self._cycles + self.phase + self._phase_correction) % 1.0
+        micro = self.micro
+        if micro is None:
+            distance = steps.end(steps.at(phase)) - phase
+        else:  # find where the (monotonic) micro signal crosses into the next step
+            i = steps.at(micro(phase))
+            lo, hi = phase, 1.0 - 1e-9
+            if steps.at(micro(hi)) == i:
+                lo = hi
             else:
-                step = self._steps[self._index]
-                self.play(step)
-        self._last_edge = int(self._cycles)
+                for n in range(16):
+                    mid = (lo + hi) / 2
+                    if steps.at(micro(mid)) == i:
+                        lo = mid
+                    else:
+                        hi = mid
+            distance = hi - phase
+        return driver.t + distance / speed + EDGE_MARGIN
+
+    def _continuous(self):
+        """Check whether tweened timing or controls need updating at the driver's grain"""
+        if isinstance(self._rate, Tween) or isinstance(self._phase, Tween) or isinstance(self.__phase_correction, Tween):
+            return True
+        if self._triggers.heap and self._triggers.heap[0][0] % 1 and self._triggers.heap[0][0] < self._cycle_edges + 1:
+            return True     # a trigger is due partway through this cycle
+        if self.controls is not None:
+            for control in self.controls:
+                if isinstance(getattr(self, "_%s" % control), Tween):
+                    return True
+        return False
 
     def update_controls(self):
         """Check if MIDI attributes have changed, and if so send"""
@@ -143,39 +321,23 @@ class Thread(object):
                 self._control_values[self._channel] = {}
             if control not in self._control_values[self._channel] or value != self._control_values[self._channel][
                 control]:
-                midi_out.send_control(self._channel, midi_clamp(self.controls[control]), value)
+                self.port.send_control(self._channel, midi_clamp(self.controls[control]), value, automation=True)
                 self._control_values[self._channel][control] = value
                 # print("[CTRL %d: %s %s]" % (self._channel, control, value))
 
     def update_triggers(self):
-        """Check trigger functions a fire as necessary"""
-        updated = False
-        for t, trigger in enumerate(self._triggers):
-            trigger[3] += 1  # increment edge
-            if (trigger[1] + 1) - trigger[
-                3] == 0:  # have to add 1 because trigger[1] is total 'elapsed' cycles but we're counting edges
-                try:
-                    if num_args(trigger[0]):
-                        trigger[0](self)
-                    else:
-                        trigger[0]()
-                except Exception as e:
-                    print("\n[Trigger error: %s]" % e)
-                if trigger[2] is True:
-                    self.trigger(trigger[0], trigger[1], True)  # create new trigger with same properties
-                else:
-                    trigger[2] -= 1
-                    if trigger[2] > 0:
-                        self.trigger(trigger[0], trigger[1], trigger[2] - 1)  # same, but decrement repeats
-                self._triggers[t] = None  # clear this trigger
-                updated = True
-        if updated:
-            self._triggers = [trigger for trigger in self._triggers if trigger is not None]
+        """Fire the triggers that are due at this point in the thread's cycles"""
+        self._triggers.fire(self._cycle_edges + self._base_phase, self)
 
     def play(self, step, velocity=None):
         """Interpret a step value to play a note"""
-        while isinstance(step, collections.Callable):
-            step = step(self) if num_args(step) else step()
+        while callable(step):
+            if profiler.enabled:
+                c = time.perf_counter()
+                step = step(self) if num_args(step) else step()
+                profiler.record('callable steps', time.perf_counter() - c)
+            else:
+                step = step(self) if num_args(step) else step()
             self.update_controls()  # to handle note-level CC changes
         if type(step) == float:  # use the part after the decimal to scale velocity
             v = step % 1
@@ -188,20 +350,15 @@ class Thread(object):
         elif step == 0 or step is None:
             self.hold()
         else:
-            transposition = self.transpose
-            if type(transposition) == list:
-                transposition = transposition[self._transpose_index % len(transposition)]
-            while type(transposition) == tuple:
-                transposition = choice(transposition)
-            if self.chord is None:
-                pitch = step + int(transposition)
-            else:
-                root, scale = self.chord
-                try:
-                    pitch = scale.quantize(root + int(transposition) + scale[step])
-                except ScaleError as e:
-                    print("\n[Error: %s]" % e)
-                    return
+            pitch = self._fast_pitch
+            if pitch is None:
+                self._compile()
+                pitch = self._fast_pitch
+            try:
+                pitch = pitch(step)
+            except ScaleError as e:
+                print("\n[Error: %s]" % e)
+                return
             velocity = 1.0 - (random() * 0.05) if velocity is None else velocity
             velocity *= self.velocity
             velocity *= v
@@ -209,14 +366,26 @@ class Thread(object):
         if step != 0:
             self._previous_step = step
 
+    def _pitch(self, step):
+        """The general pitch of a step, for when transpose or chord are tweened or vary by step"""
+        transposition = self.transpose
+        if type(transposition) == list:
+            transposition = transposition[self._transpose_index % len(transposition)]
+        while type(transposition) == tuple:
+            transposition = choice(transposition)
+        if self.chord is None:
+            return step + int(transposition)
+        root, scale = self.chord
+        return scale.quantize(root + int(transposition) + scale[step])
+
     def note(self, pitch, velocity):
         """Override for custom MIDI behavior"""
         if self.keyboard is True and velocity == 0:
-            midi_out.send_note(self._channel, pitch, 0)
+            self.port.send_note(self._channel, pitch, 0)
         else:
             if self.keyboard is not True:
-                midi_out.send_note(self._channel, self._previous_pitch, 0)
-            midi_out.send_note(self._channel, pitch, midi_clamp(velocity * 127))
+                self.port.send_note(self._channel, self._previous_pitch, 0)
+            self.port.send_note(self._channel, pitch, midi_clamp(velocity * 127))
             self._previous_pitch = pitch
 
     def hold(self):
@@ -225,7 +394,7 @@ class Thread(object):
 
     def rest(self):
         """Send a MIDI off"""
-        midi_out.send_note(self._channel, self._previous_pitch, 0)
+        self.port.send_note(self._channel, self._previous_pitch, 0)
 
     def end(self):
         """Override to add behavior for the end of the piece, otherwise rest"""
@@ -272,6 +441,21 @@ class Thread(object):
     @channel.setter
     def channel(self, channel):
         self._channel = channel
+        driver.reschedule(self)     # so its controls go out on the new channel
+
+    @property
+    def port(self):
+        """The MidiOut this thread sends through: its own if set, otherwise the router's port for its channel"""
+        return self._port if self._port is not None else router.port(self._channel)
+
+    @port.setter
+    def port(self, port):
+        if type(port) == int:
+            port = router.open(port)
+        elif port is not None:
+            router.add(port)
+        self._port = port
+        driver.reschedule(self)
 
     @property
     def pattern(self):
@@ -282,7 +466,7 @@ class Thread(object):
     @pattern.setter
     def pattern(self, pattern):
         if isinstance(pattern, Tween):
-            pattern.start(self, self.pattern)
+            pattern.start(self, self.pattern, '_pattern')
         else:
             pattern = Pattern(pattern)
         self._pattern = pattern
@@ -302,6 +486,7 @@ class Thread(object):
                     rate.start(self, self.rate)
                     phase_correction = tween(89.9, rate.cycles)  # make a tween for the subsequent phase correction
                     phase_correction.start(driver, self._phase_correction)
+                    phase_correction.activate(self, '_Thread__phase_correction')
                     self.__phase_correction = phase_correction
                     self._rate = rate
 
@@ -311,6 +496,7 @@ class Thread(object):
             else:
                 rate.start(self, self.rate)
         self._rate = rate
+        driver.reschedule(self)
 
     @property
     def _phase_correction(self):
@@ -321,10 +507,13 @@ class Thread(object):
     """Sequencing"""
 
     def start(self, thread=None):
+        if LIVECODING and not driver.is_alive():
+            play()
         self._running = True
         if thread is not None:
-            self._cycles = math.floor(thread._cycles)
-            time_to_edge = (thread._cycles % 1.0) / thread.rate
+            cycles = thread._current_cycles()
+            self._cycles = math.floor(cycles)
+            time_to_edge = (cycles % 1.0) / thread.rate
             self._cycles += time_to_edge * self.rate
 
             self._last_edge = 0
@@ -334,6 +523,9 @@ class Thread(object):
             self._cycles = 0.0
             self._last_edge = 0
             self._index = -1
+        self._driver_cycles = driver._cycles
+        self._tick_rate = self.rate
+        driver.reschedule(self)
         print("[Thread started on channel %s]" % self._channel)
 
     def stop(self):
@@ -342,19 +534,11 @@ class Thread(object):
         print("[Thread stopped on channel %s]" % self._channel)
 
     def trigger(self, f=None, cycles=0, repeat=0):
-        if f is None and repeat is False:
-            self._triggers = [trigger for trigger in self._triggers if trigger[2] is not True]  # filter repeat=True
-        elif f is False:
-            self._triggers = []
-        else:
-            try:
-                assert (callable(f))
-                if cycles == 0:
-                    assert repeat == 0
-            except AssertionError as e:
-                print("\n[Bad arguments for trigger]")
-            else:
-                self._triggers.append([f, cycles, repeat, 0])  # last parameter is cycle edges so far
+        """Call f (with this thread, if it takes an argument) at the end of the current cycle, after waiting the given number
+           of complete cycles (fractions too), repeating it every that many cycles forever (repeat=True) or until it has been called repeat times
+        """
+        Triggers.schedule(self, f, cycles, repeat, self._cycle_edges + self._base_phase)
+        driver.reschedule(self)
 
 
 def midi_clamp(value):
@@ -378,18 +562,34 @@ def make(controls={}, defaults={}):
 
 Thread.setup()
 
-synths = {}
-try:
-    with open(os.path.join(os.path.dirname(__file__), "synths.yaml")) as f:
-        synths.update(yaml.safe_load(f))
-except FileNotFoundError as e:
-    pass
-if len(synths):
-    for synth, params in synths.items():
+synths = None   # synth name -> params, read from synths.yaml on first use
+
+
+def load_synths():
+    global synths
+    if synths is None:
+        import yaml
+        synths = {}
         try:
-            controls = params['controls']
-            defaults = params['defaults']
-            exec("%s = make(controls, defaults)" % synth)
-        except Exception as e:
-            print("Warning: failed to load %s:" % synth, e)
-    print("Loaded synths")
+            with open(os.path.join(os.path.dirname(__file__), "synths.yaml")) as f:
+                synths.update(yaml.safe_load(f))
+        except FileNotFoundError as e:
+            pass
+    return synths
+
+
+def __getattr__(name):
+    """Make synth Threads from synths.yaml the first time they're asked for"""
+    params = None if name.startswith('__') else load_synths().get(name)
+    if params is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    try:
+        T = make(params['controls'], params['defaults'])
+    except Exception as e:
+        print("Warning: failed to load %s:" % name, e)
+        raise AttributeError(name)
+    from .custom import customizations
+    for attr, value in customizations.get(name, {}).items():
+        setattr(T, attr, value)
+    globals()[name] = T
+    return T
@@ -1,7 +1,7 @@
 import collections, math
 from random import random, uniform, choice
 from .signal import linear, sine, pulse, inverse_linear, triangle
-from .pattern import Q, Pattern, blend, euc, add, xor
+from .pattern import Q, Pattern, blend, blend_steps, euc, add, xor
 from .core import driver
 
 
@@ -28,9 +28,14 @@ class Tween(object):
         self._steps = [0., .25, .5, .75]
         self._step = 0
         self.finished = False
+        self.owner = None
+        self.attr = None
+        self._cycles = None     # the thread cycle that the cached position and value are for
+        self._position = 0.0
+        self._value = None
 
 
-    def start(self, thread, start_value):
+    def start(self, thread, start_value, attr=None):
         self.thread = thread
         self._step = 0
         if self.start_value is None:
@@ -38,13 +43,45 @@ class Tween(object):
             self._min_value = min(self.start_value, self.target_value)
             self._max_value = max(self.start_value, self.target_value)
         self.start_cycle = float(math.ceil(self.thread._cycles)) # tweens always start on next cycle
+        self.activate(thread, attr)
+
+    def activate(self, owner, attr=None):
+        """Register with the driver, which advances the tween each tick and puts owner.attr back to a plain value when it finishes
+           Without an attr there's nothing for the driver to put back or to tell when it's dropped, so the tween only advances when read
+        """
+        self.owner = owner
+        self.attr = attr
+        self.finished = False
+        self._cycles = None
+        if attr is not None and self not in driver.tweens:
+            driver.tweens.append(self)
 
     @property
-    def value(self):
+    def attached(self):
+        """Whether the tween is still in place on the attribute it was set on"""
+        return self.attr is None or getattr(self.owner, self.attr, None) is self
+
+    def detach(self):
+        """Replace the tween with its target value on the attribute it was set on"""
+        if self.attr is not None and self.attached:
+            setattr(self.owner, self.attr, self.target_value)
+            driver.reschedule(self.owner)
+
+    def advance(self):
+        """Bring the tween up to its thread's cycle, once per change of cycle: fire on_end, turn osc and saw tweens around, and cache the value"""
+        cycles = self.thread._cycles
+        if cycles == self._cycles:
+            return
+        self._cycles = cycles
         if self.finished:
-            return self.target_value
-        if self.random:
-            if self._steps[self._step] <= self.position < self._steps[self._step] + self._step_len:
+            self._position = 1.0
+            self._value = self.target_value
+            return
+        self._position = self.calc_position(cycles)
+        if self.finished:
+            self._value = self.target_value
+        elif self.random:
+            if self._steps[self._step] <= self._position < self._steps[self._step] + self._step_len:
                 if self.rand_lock:
                     self._lock_values.rotate(-1)
                     self._random_value = self._lock_values[-1]
@@ -52,9 +89,14 @@ class Tween(object):
                     lag_diff = (uniform(self._min_value, self._max_value) - self._random_value) * self._lag
                     self._random_value += lag_diff
                 self._step = (self._step + 1) % len(self._steps)
-            return self._random_value
+            self._value = self._random_value
         else:
-            return self.calc_value(self.signal_position)
+            self._value = self.calc_value(self.signal_f((self._position + self.phase_offset) % 1.0))
+
+    @property
+    def value(self):
+        self.advance()
+        return self._value
 
     @property
     def signal_position(self): # can reference this to see where we are on the signal function
@@ -62,9 +104,16 @@ class Tween(object):
 
     @property
     def position(self): # can reference this to see where we are in the tween
+        self.advance()
+        return self._position
+
+    def calc_position(self, cycles):
         if self.cycles == 0.0:
-            return 1.0
-        position = (self.thread._cycles - self.start_cycle) / self.cycles
+            if self.osc or self.saw:
+                return 1.0
+            position = 1.0
+        else:
+            position = (cycles - self.start_cycle) / self.cycles
         if position <= 0.0:
             position = 0.0
         if position >= 1.0:
@@ -79,11 +128,10 @@ class Tween(object):
                     sv = self.target_value
                     self.target_value = self.start_value
                     self.start_value = sv
-                self.start_cycle = self.thread._cycles - ((self.thread._cycles - self.start_cycle) - self.cycles)
+                self.start_cycle = cycles - ((cycles - self.start_cycle) - self.cycles)
                 position = abs(1 - position)
             else:
                 self.finished = True
-                print('finished is true')
         return position
 
     @property
@@ -119,18 +167,41 @@ class ChordTween(Tween):
 
 
 class PatternTween(Tween):
+    """Blends once per cycle edge of its thread, and serves that blend to every read until the next,
+       working from the flat steps of each pattern, which are only re-resolved when they're stochastic
+    """
+
+    def start(self, thread, start_value, attr=None):
+        Tween.start(self, thread, start_value, attr)
+        if type(self.start_value) is not Pattern:
+            self.start_value = Pattern(self.start_value)
+        self._edge = None
+        self._blend = None
+        self._flat = {}     # id(pattern) -> (resolved steps, flat steps)
 
     def calc_value(self, position):
-        return blend(self.start_value, self.target_value, position)
+        edge = self.thread._cycle_edges
+        if edge != self._edge:
+            self._edge = edge
+            self._blend = Pattern(blend_steps(self._flatten(self.start_value), self._flatten(self.target_value), position))
+        return self._blend
+
+    def _flatten(self, pattern):
+        steps = pattern.resolve()   # the same compiled steps each time, unless the pattern is stochastic
+        cached = self._flat.get(id(pattern))
+        if cached is None or cached[0] is not steps:
+            cached = self._flat[id(pattern)] = steps, steps.dense()
+        return cached[1]
 
 
 class RateTween(ScalarTween):
 
-    def start(self, thread, start_value):
+    def start(self, thread, start_value, attr='_rate'):
         self.thread = driver    # rate tweens are based on the driver reference
         self.syncer = thread    # this is the actual reference to the current thread
         self.start_value = start_value
         self.start_cycle = driver._cycles # float(math.ceil(driver._cycles)) # it's a float, so if you ceil this, it's always the _next_ edge, even if it should be "0"
+        self.activate(thread, attr)
 
     def get_phase(self):
         driver_cycles_remaining = self.cycles - (driver._cycles - self.start_cycle)
@@ -24,5 +24,8 @@ setup(
         "python-rtmidi>=1.0.0",
         "PyYAML>=3.11"
     ],
+    extras_require={
+        "fast": ["numpy"],     # vectorized signals and wavetables, and the compact driver's edge table
+    },
     python_requires=">=3.7",
 )
@@ -0,0 +1,115 @@
+import io, threading, unittest, unittest.mock, contextlib
+from braid import midi
+
+
+class SupersededControls(unittest.TestCase):
+
+    def setUp(self):
+        self.port = midi.MidiOut(backend=midi.RecordingMidi(), lazy=True)
+
+    def due(self, *messages, automation=True):
+        for message in messages:
+            self.port._events.append((0.0, next(self.port._sequence), message, automation))
+        return [message for message in self.port._pop_due() if message is not None]
+
+    def test_only_the_latest_value_of_an_automated_control_goes_out(self):
+        batch = self.due([0xB0, 41, 10], [0xB0, 41, 20], [0xB0, 42, 30])
+        self.assertEqual(batch, [[0xB0, 41, 20], [0xB0, 42, 30]])
+        self.assertEqual(self.port.superseded, 1)
+
+    def test_a_note_on_the_channel_keeps_the_control_before_it(self):
+        batch = self.due([0xB0, 41, 10], [0x90, 60, 100], [0xB0, 41, 20], [0x90, 62, 100])
+        self.assertEqual(batch, [[0xB0, 41, 10], [0x90, 60, 100], [0xB0, 41, 20], [0x90, 62, 100]])
+        self.assertEqual(self.port.superseded, 0)
+
+    def test_a_note_on_another_channel_does_not(self):
+        batch = self.due([0xB0, 41, 10], [0x91, 60, 100], [0xB0, 41, 20])
+        self.assertEqual(batch, [[0x91, 60, 100], [0xB0, 41, 20]])
+
+    def test_controls_sent_directly_all_go_out(self):
+        batch = self.due([0xB0, 64, 127], [0xB0, 64, 0], automation=False)     # a sustain tap
+        self.assertEqual(batch, [[0xB0, 64, 127], [0xB0, 64, 0]])
+        self.assertEqual(self.port.superseded, 0)
+
+    def test_a_pulse_in_one_tick_goes_out_whole(self):
+        self.port.timestamp = 0.0
+        self.port._opened = True    # queue without a sender
+        self.port.send_control(1, 64, 127)
+        self.port.send_control(1, 64, 0)
+        self.port.send_control(1, 41, 10, automation=True)
+        self.port.send_control(1, 41, 20, automation=True)
+        batch = [message for message in self.port._pop_due() if message is not None]
+        self.assertEqual(batch, [[0xB0, 64, 127], [0xB0, 64, 0], [0xB0, 41, 20]])
+
+
+class Capture(unittest.TestCase):
+
+    def test_captured_messages_are_elided_like_sent_ones(self):
+        port = midi.MidiOut(backend=midi.RecordingMidi(), lazy=True)
+        port._controls[0xB0, 41] = 10      # already sent, but not in the capture
+        port.capture = []
+        port.send_control(1, 41, 10)
+        port.send_control(1, 41, 10)
+        port.send_note(1, 60, 0)            # off for a note that isn't on
+        port.send_note(1, 62, 100)
+        port.send_note(1, 62, 0)
+        self.assertEqual([message for t, message in port.capture], [[0xB0, 41, 10], [0x90, 62, 100], [0x80, 62, 0]])
+        self.assertEqual(port.elided, 2)
+
+
+class Input(unittest.TestCase):
+
+    def test_assigning_threads_opens_the_input(self):
+        port = midi.MidiIn(backend=midi.NullMidi(), lazy=True)
+        port.threads = []
+        self.assertFalse(port._opened)
+        port.threads = [None]
+        self.assertTrue(port._opened)
+
+
+@unittest.skipIf(midi.rtmidi is None, "needs rtmidi")
+class Reopening(unittest.TestCase):
+
+    def test_changing_interface_keeps_one_sender(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            port = midi.MidiOut(0)
+            count = threading.active_count()
+            port.interface = 0
+            port.interface = 0
+        self.assertEqual(threading.active_count(), count)
+        self.assertTrue(port.is_alive())
+        port.send_control(1, 41, 10)
+        port.flush()
+        self.assertEqual(port.sent, 1)
+
+    def test_changing_input_interface_keeps_the_callback(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            port = midi.MidiIn(0)
+            count = threading.active_count()
+            port.interface = 0
+        self.assertEqual(threading.active_count(), count)
+        port.midi.set_callback = unittest.mock.Mock()
+        with contextlib.redirect_stdout(io.StringIO()):
+            port.interface = 0
+        port.midi.set_callback.assert_called_once_with(port._receive)
+
+
+class Routing(unittest.TestCase):
+
+    def setUp(self):
+        self.router = midi.MidiRouter(midi.MidiOut(backend=midi.RecordingMidi(), lazy=True))
+
+    def test_an_interface_is_opened_once(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            port = self.router.route(3, 5)
+            self.assertIs(self.router.route(3, range(6, 9)), port)
+            self.assertIs(self.router.open(3), port)
+        self.assertEqual(self.router.ports, [self.router.default, port])
+        self.assertIs(self.router.port(7), port)
+
+    def test_the_default_interface_is_the_default_port(self):
+        self.assertIs(self.router.open(midi.interface_arg(1)), self.router.default)
+
+
+if __name__ == '__main__':
+    unittest.main()
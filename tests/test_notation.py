@@ -0,0 +1,15 @@
+import unittest
+from braid.notation import Scale
+
+
+class Mutation(unittest.TestCase):
+
+    def test_clearing_a_scale_drops_its_tables(self):
+        scale = Scale([0, 2, 4, 5, 7, 9, 11])
+        scale.clear()
+        self.assertEqual(scale._degrees, {})
+        self.assertEqual(scale._quantized, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import io, unittest, contextlib
+from braid import *
+from braid import midi
+
+
+class SparseSteps(unittest.TestCase):
+
+    def setUp(self):
+        midi_out.midi = midi.RecordingMidi()
+        del driver.threads[:]
+        tempo(120)
+
+    def tearDown(self):
+        del driver.threads[:]
+
+    def pitches(self, pattern, transpose, transpose_step_len, cycles=3):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t = Thread(1)
+            t.pattern = pattern
+            t.transpose = transpose
+            t.transpose_step_len = transpose_step_len
+            events = driver.render(cycles)
+        return [message[1] for stamp, message in events if message[0] == midi.NOTE_ON and message[2] > 0]
+
+    def test_dense_is_the_lcm_grid(self):
+        steps = Pattern([1, [2, 3], 0]).resolve()
+        self.assertEqual(list(steps), [1, 2, 3, 0])
+        self.assertEqual(steps.dense(), [1, 0, 2, 3, 0, 0])
+
+    def test_clearing_a_pattern_drops_its_steps(self):
+        p = Pattern([1, [2, 3]])
+        p.resolve()
+        p.clear()
+        self.assertIsNone(p._table)
+
+    def test_transpose_lists_move_on_every_lcm_division(self):
+        self.assertEqual(self.pitches([1, [2, 3], 0], [0, 12, 24], 1)[:6], [1, 26, 3, 1, 26, 3])
+        self.assertEqual(self.pitches([[1, 2, 3], [4, 5]], [0, 7, 12, 5], 2)[:10], [1, 9, 15, 9, 5, 13, 7, 3, 11, 17])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import io, os, math, time, tempfile, threading, unittest, contextlib
+from braid import *
+from braid import midi
+from braid.clock import ClockOut
+
+
+class ScheduledTempoChange(unittest.TestCase):
+
+    def setUp(self):
+        midi_out.midi = midi.RecordingMidi()
+        del driver.threads[:]
+        driver._edges = []
+
+    def tearDown(self):
+        trigger(False)
+        del driver.threads[:]
+        tempo(120)
+
+    def test_steps_follow_a_tempo_change_between_edges(self):
+        tempo(120)      # 0.5 cycles per second, so quarter-cycle steps every 0.5s
+        with contextlib.redirect_stdout(io.StringIO()):
+            t = Thread(1)
+            t.pattern = [1, 1, 1, 1]
+            trigger(lambda: tempo(480), 0.3)    # at cycle 1.3, partway through a step
+            events = driver.render(3)
+        onsets = [stamp for stamp, message in events if message[0] == midi.NOTE_ON and message[2] > 0]
+        expected = []
+        for k in range(len(onsets)):
+            cycles = k / 4
+            expected.append(cycles / 0.5 if cycles <= 1.3 else 2.6 + (cycles - 1.3) / 2.0)
+        self.assertEqual(len(onsets), 13)
+        for onset, t in zip(onsets, expected):
+            self.assertAlmostEqual(onset, t, delta=0.002)
+
+    def test_tempo_applies_from_the_first_tick_when_stopped(self):
+        tempo(60)
+        self.assertEqual(driver._tick_rate, driver.rate)
+        cycles = driver._cycles
+        driver.update(1.0)
+        self.assertAlmostEqual(driver._cycles - cycles, 0.25)
+
+
+class Port(object):
+
+    def __init__(self):
+        self.messages = []
+
+    def push(self, message, t=None):
+        self.messages.append((message[0], time.perf_counter() if t is None else t))
+
+
+class Driver(object):
+    """Just what ClockOut reads, at one cycle per second from a quarter cycle in, with no lookahead"""
+
+    def __init__(self):
+        self.running = True
+        self.rendering = False
+        self._lock = threading.Lock()
+        self.rate = 1.0
+        self.start_t = time.perf_counter()
+
+    def now(self):
+        return time.perf_counter() - self.start_t
+
+    @property
+    def t(self):
+        return self.now()
+
+    @property
+    def _cycles(self):
+        return 0.25 + self.now() * self.rate
+
+
+class ClockOutTransport(unittest.TestCase):
+
+    def test_start_on_the_next_cycle_and_continue_after_a_pause(self):
+        driver, port = Driver(), Port()
+        t = time.perf_counter()
+        clock_out = ClockOut(driver, port)
+        time.sleep(0.1)
+        self.assertEqual(port.messages, [])     # still waiting for cycle 1
+        time.sleep(0.75)
+        kinds = [kind for kind, due in port.messages]
+        self.assertEqual(kinds[0], midi.START)
+        self.assertAlmostEqual(port.messages[0][1] - t, 0.75, delta=0.01)
+        self.assertEqual(kinds[1], midi.TIMING_CLOCK)
+        driver.running = False
+        time.sleep(0.05)
+        self.assertEqual(port.messages[-1][0], midi.STOP)
+        del port.messages[:]
+        driver.running = True
+        time.sleep(0.05)
+        self.assertEqual(port.messages[0][0], midi.CONTINUE)
+        driver.running = False
+        clock_out.rewind()
+        time.sleep(0.05)
+        del port.messages[:]
+        driver.running = True
+        time.sleep(0.05)
+        self.assertEqual(port.messages, [])     # a stop starts again from the next cycle
+        clock_out.port = None
+
+
+class RenderingWithClockOut(unittest.TestCase):
+
+    def setUp(self):
+        midi_out.midi = midi.RecordingMidi()
+        del driver.threads[:]
+        self.port = router.add(midi.MidiOut(backend=midi.RecordingMidi(), lazy=True))
+
+    def tearDown(self):
+        trigger(False)
+        driver.clock_out = None
+        driver.running = False
+        router.ports.remove(self.port)
+        del driver.threads[:]
+
+    def test_clock_and_transport_stay_out_of_the_render(self):
+        tempo(120)
+        driver._cycles = float(math.ceil(driver._cycles))   # on a cycle boundary, so receivers start straight away
+        driver.clock_out = self.port
+        driver.running = True
+        time.sleep(0.05)
+        self.assertEqual(self.port.midi.messages[0][1], [midi.START])
+        with contextlib.redirect_stdout(io.StringIO()):
+            t = Thread(1)
+            t.pattern = [1, 1]
+            trigger(lambda: time.sleep(0.05))      # long enough for the clock to notice the render
+            events = driver.render(2)
+        self.assertTrue(events)
+        self.assertEqual([message for stamp, message in events if message[0] >= 0xF0], [])
+        driver.running = False
+        time.sleep(0.05)
+        sent = [message[0] for stamp, message in self.port.midi.messages]
+        self.assertIn(midi.STOP, sent)
+
+    def test_system_messages_are_left_out_of_midi_files(self):
+        events = [(0.0, [0xFA]), (0.0, [0x90, 60, 100]), (0.25, [0xF8]), (0.5, [0x80, 60, 0]), (0.5, [0xFC])]
+        with tempfile.TemporaryDirectory() as directory:
+            midi.write_midi_file(os.path.join(directory, 'a.mid'), events, 120)
+            midi.write_midi_file(os.path.join(directory, 'b.mid'), [event for event in events if event[1][0] < 0xF0], 120)
+            with open(os.path.join(directory, 'a.mid'), 'rb') as a, open(os.path.join(directory, 'b.mid'), 'rb') as b:
+                self.assertEqual(a.read(), b.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
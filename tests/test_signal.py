@@ -0,0 +1,14 @@
+import unittest
+from braid import signal
+
+
+class Breakpoints(unittest.TestCase):
+
+    def test_linear_can_be_passed_uncalled(self):
+        f = signal.breakpoints([0, 0], [1, 1, signal.linear])
+        for pos in (0.0, 0.25, 0.5, 0.9, 1.0):
+            self.assertAlmostEqual(f(pos), pos)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import io, unittest, contextlib
+from braid import *
+from braid import midi
+
+
+class Controls(unittest.TestCase):
+
+    def setUp(self):
+        midi_out.midi = midi.RecordingMidi()
+        del driver.threads[:]
+        tempo(120)
+
+    def tearDown(self):
+        trigger(False)
+        del driver.threads[:]
+
+    def test_changing_channel_resends_the_controls(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            S = make({'cutoff': 20}, {'cutoff': 64})
+            s = S(1)
+            s.pattern = [1, 1]
+            trigger(lambda: setattr(s, 'channel', 2), 0.5)
+            events = driver.render(2)
+        controls = [((message[0] & 0x0F) + 1, message[1], message[2]) for stamp, message in events
+                    if message[0] & 0xF0 == midi.CONTROLLER_CHANGE]
+        self.assertEqual(controls, [(1, 20, 64), (2, 20, 64)])
+
+
+class Tweens(unittest.TestCase):
+
+    def setUp(self):
+        midi_out.midi = midi.RecordingMidi()
+        del driver.threads[:]
+        del driver.tweens[:]
+        tempo(120)
+
+    def tearDown(self):
+        del driver.threads[:]
+        del driver.tweens[:]
+
+    def test_standalone_tweens_are_not_kept_by_the_driver(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t = Thread(1)
+            t.pattern = [1]
+            standalone = osc(0, 127, 1)
+            standalone.start(t, 0)
+            t.velocity = tween(0.5, 1)
+            self.assertEqual(driver.tweens, [t._velocity])
+            driver.render(3)
+        self.assertEqual(driver.tweens, [])
+        self.assertEqual(t.velocity, 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()